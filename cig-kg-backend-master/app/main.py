@@ -14,6 +14,7 @@ from app.config.database import engine
 from app.services import getEntities_service
 from app.pdf_module import pdf_module
 from app.pdf_module.models import PDFFile  # 导入PDF模型以创建表
+from app.utils.llm_client import close_llm_clients
 app = FastAPI(title="Knowledge Graph Builder API")
 
 # 配置CORS
@@ -46,8 +47,9 @@ async def startup_event():
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """应用关闭时关闭 Neo4j 驱动程序"""
+    """应用关闭时关闭 Neo4j 驱动程序与大模型连接池"""
     await neo4j_service.close()
+    close_llm_clients()
 
 @app.get("/")
 def read_root():
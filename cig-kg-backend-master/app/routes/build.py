@@ -1,12 +1,17 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from app.services.pdf_service import PDFService
-from app.services.kg_build_service import KGBuildService
+from app.services.build_job_service import build_job_manager
 from app.dependencies.dependencies import get_neo4j_service  # 从 dependencies.py 导入
+from app.utils.build_manifest import list_chunk_files
+from app.utils.llm_backends import get_backend_pool
+from app.utils.dedup_index import get_dedup_index
+from app.utils.llm_cache import get_llm_cache
+from app.utils.llm_scheduler import get_llm_scheduler
+from app.utils.page_cache import get_page_cache
 import shutil
 import os
 import json
+import uuid
 from typing import Optional
-from datetime import datetime
 
 
 router = APIRouter()
@@ -18,69 +23,35 @@ TEST_FILE = "X6_Electrical-Instruction_Data-Sheet_Manual_CHI.md"
 async def build_knowledge_graph(
         file: UploadFile = File(..., description="上传的PDF文件"),
         database_name: str = Form(..., description="目标数据库名称"),
-        prompt: str = Form(..., description="构建提示词")
+        prompt: str = Form(..., description="构建提示词"),
+        max_workers: Optional[int] = Form(None, description="并发抽取的最大在途请求数，默认取 EXTRACT_MAX_WORKERS"),
+        bypass_cache: bool = Form(False, description="为真时跳过抽取结果缓存，所有分块重新调用大模型"),
+        hedge: Optional[bool] = Form(None, description="是否对慢请求补发对冲请求，默认取 LLM_HEDGE_ENABLED"),
+        compact: Optional[bool] = Form(None, description="是否让模型使用紧凑输出格式，默认取 LLM_COMPACT_OUTPUT")
 ):
-    """构建知识图谱接口"""
+    """构建知识图谱接口：保存文件后提交后台构建任务，立即返回任务ID"""
     try:
-        pdf_service = PDFService()
-        kg_build_service = KGBuildService()
-
         # 1. 验证文件类型
         if not file.filename.lower().endswith('.pdf'):
             raise HTTPException(status_code=400, detail="仅支持PDF文件")
 
-        # 2. 保存上传文件
+        # 2. 保存上传文件，加前缀避免同名文件的并行任务互相覆盖
         upload_dir = "uploads"
         os.makedirs(upload_dir, exist_ok=True)
-        file_path = os.path.join(upload_dir, file.filename)
+        file_path = os.path.join(upload_dir, f"{uuid.uuid4()}_{file.filename}")
 
         with open(file_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
 
-        # 3. 解析PDF内容并保存预处理结果
-        # TODO: 替换为OCR识别接口
-        md_text = pdf_service.pdf2md(file_path)
-
-        # 创建预处理文件夹
-        preprocess_dir = "doc_preprocessed"
-        os.makedirs(preprocess_dir, exist_ok=True)
-
-        # 根据文件名创建子文件夹
-        file_name_without_extension = os.path.splitext(file.filename)[0]
-        preprocess_file_dir = os.path.join(preprocess_dir, file_name_without_extension)
-        os.makedirs(preprocess_file_dir, exist_ok=True)
-
-
-        # 生成带时间戳的预处理文件名
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        preprocessed_filename = f"{os.path.splitext(file.filename)[0]}_{timestamp}.md"
-        preprocessed_path = os.path.join(preprocess_file_dir, preprocessed_filename)
-
-        # TODO: 替换为OCR识别接口后图片的相关处理
-        # 保存预处理内容
-        with open(preprocessed_path, "w", encoding="utf-8") as f:
-            f.write(md_text)
-
-        # 4. 构建知识图谱
-
-        # 创建 json 文件夹，包含了模型抽取节点与关系的结果
-        kg_output_dir = "kg_output"
-        os.makedirs(kg_output_dir, exist_ok=True)
-
-        # 根据文件名创建子文件夹
-        kg_output_file_dir = os.path.join(kg_output_dir, file_name_without_extension)
-        os.makedirs(kg_output_file_dir, exist_ok=True)
-
-        result = kg_build_service.build_graph(kg_output_file_dir, preprocessed_path, prompt, database_name)
-
-        # 5. 清理临时文件
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        # 3. 提交后台任务：PDF解析、分块抽取与导入Neo4j均在任务中执行
+        job = build_job_manager.submit(file_path, file.filename, database_name, prompt,
+                                       max_workers=max_workers, use_cache=not bypass_cache, hedge=hedge,
+                                       compact=compact)
 
         return {
             "success": True,
-            "message": "知识图谱构建完成",
-            "preprocessed_file": preprocessed_filename,
+            "message": "知识图谱构建任务已提交",
+            "job_id": job.job_id,
         }
 
     except HTTPException as he:
@@ -91,6 +62,53 @@ async def build_knowledge_graph(
             "message": f"构建失败: {str(e)}"
         }
 
+
+@router.get("/jobs")
+async def list_build_jobs():
+    """获取所有构建任务及其进度"""
+    return [job.to_dict() for job in build_job_manager.list()]
+
+
+@router.get("/jobs/{job_id}")
+async def get_build_job(job_id: str):
+    """查询构建任务的阶段、分块进度与预计剩余时间"""
+    job = build_job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在, job_id={job_id}")
+    return job.to_dict()
+
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_build_job(job_id: str):
+    """取消构建任务"""
+    job = build_job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在, job_id={job_id}")
+    return job.to_dict()
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """查询抽取结果缓存、近重复分块索引与PDF逐页缓存的命中统计与占用空间"""
+    stats = get_llm_cache().stats()
+    dedup_index = get_dedup_index()
+    stats["near_duplicate"] = dedup_index.stats() if dedup_index is not None else None
+    page_cache = get_page_cache()
+    stats["pdf_pages"] = page_cache.stats() if page_cache is not None else None
+    return stats
+
+
+@router.get("/llm/metrics")
+async def get_llm_metrics():
+    """查询大模型调度器的排队深度、在途请求数、限流与重试次数"""
+    return get_llm_scheduler().metrics()
+
+
+@router.get("/llm/backends")
+async def get_llm_backends():
+    """查询各模型服务端点的权重、在途请求数、平均耗时与摘除状态"""
+    return get_backend_pool().status()
+
+
 @router.get("/kg_extract")
 async def kg_extract(
         file: UploadFile = File(..., description="上传的PDF文件"),
@@ -116,7 +134,7 @@ async def kg_extract(
         # 根据文件名创建子文件夹
         kg_output_file_dir = os.path.join(kg_output_dir, file_name_without_extension)
 
-        for filename in os.listdir(kg_output_file_dir):
+        for filename in list_chunk_files(kg_output_file_dir):
             if filename.endswith('.json'):
                 filepath = os.path.join(kg_output_file_dir, filename)
                 try:
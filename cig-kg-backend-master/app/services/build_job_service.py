@@ -0,0 +1,274 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from dotenv import load_dotenv
+
+from app.services.kg_build_service import KGBuildService
+from app.services.pdf_service import PDFService
+
+# 任务状态
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+FINISHED_STATES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_identical_preprocessed(preprocess_file_dir: str, md_path: str) -> Optional[str]:
+    """返回目录中最近一次预处理结果的文件名，内容与 md_path 不同或不存在时返回 None"""
+    md_files = sorted(name for name in os.listdir(preprocess_file_dir) if name.endswith(".md"))
+    if not md_files:
+        return None
+    latest = os.path.join(preprocess_file_dir, md_files[-1])
+    if os.path.getsize(latest) != os.path.getsize(md_path):
+        return None
+    return md_files[-1] if file_sha256(latest) == file_sha256(md_path) else None
+
+
+class BuildJob:
+    """一次知识图谱构建任务的状态与进度"""
+
+    def __init__(self, file_path: str, file_name: str, database_name: str, prompt: str,
+                 max_workers: Optional[int] = None, use_cache: bool = True, hedge: Optional[bool] = None,
+                 compact: Optional[bool] = None):
+        self.job_id = str(uuid.uuid4())
+        self.file_path = file_path
+        self.file_name = file_name
+        self.database_name = database_name
+        self.prompt = prompt
+        self.max_workers = max_workers
+        self.use_cache = use_cache
+        self.hedge = hedge
+        self.compact = compact
+
+        self.status = JOB_PENDING
+        self.stage = "queued"
+        self.chunks_done = 0
+        self.chunks_total = None  # 分块阶段结束前未知
+        self.preprocessed_file = None
+        self.error = None
+        self.stats = {}
+        self.created_at = time.time()
+        self.started_at = None
+        self.extract_started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    def update_progress(self, stage: str, done: int = 0, total: Optional[int] = None):
+        """供构建流程回调，记录当前阶段与分块进度，分块总数未知时 total 为 None"""
+        if stage == "extracting" and self.extract_started_at is None:
+            self.extract_started_at = time.time()
+        self.stage = stage
+        self.chunks_done = done
+        self.chunks_total = total
+
+    def eta_seconds(self) -> Optional[float]:
+        """按已完成分块的平均耗时估算抽取阶段剩余时间"""
+        if self.status != JOB_RUNNING or self.stage != "extracting":
+            return None
+        if not self.extract_started_at or self.chunks_done == 0 or not self.chunks_total:
+            return None
+        elapsed = time.time() - self.extract_started_at
+        remaining = self.chunks_total - self.chunks_done
+        return round(elapsed / self.chunks_done * remaining, 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        def fmt(ts):
+            return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S") if ts else None
+
+        return {
+            "job_id": self.job_id,
+            "file_name": self.file_name,
+            "database_name": self.database_name,
+            "status": self.status,
+            "stage": self.stage,
+            "chunks_done": self.chunks_done,
+            "chunks_total": self.chunks_total,
+            "eta_seconds": self.eta_seconds(),
+            "preprocessed_file": self.preprocessed_file,
+            "error": self.error,
+            "stats": self.stats,
+            "created_at": fmt(self.created_at),
+            "started_at": fmt(self.started_at),
+            "finished_at": fmt(self.finished_at),
+        }
+
+
+class BuildJobManager:
+    """用有界线程池在后台执行构建任务，接口只负责提交与查询
+
+    同一文档的任务共用 doc_preprocessed/<doc> 与 kg_output/<doc> 下的构建清单和分块结果，按提交顺序逐个执行；
+    已结束的任务保留 job_ttl 秒，且最多保留 max_finished 个。
+    """
+
+    def __init__(self, max_workers: int = 2, job_ttl: float = 86400.0, max_finished: int = 200):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kg-build")
+        self.jobs: Dict[str, BuildJob] = {}
+        self.job_ttl = job_ttl
+        self.max_finished = max_finished
+        self._lock = threading.Lock()
+        # 文档名 -> [锁, 使用中的任务数]，没有任务使用时删除
+        self._doc_locks: Dict[str, list] = {}
+
+    def submit(self, file_path: str, file_name: str, database_name: str, prompt: str,
+               max_workers: Optional[int] = None, use_cache: bool = True, hedge: Optional[bool] = None,
+               compact: Optional[bool] = None) -> BuildJob:
+        """登记任务并放入线程池排队"""
+        job = BuildJob(file_path, file_name, database_name, prompt, max_workers, use_cache, hedge, compact)
+        with self._lock:
+            self._evict_finished()
+            self.jobs[job.job_id] = job
+        self.executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[BuildJob]:
+        return self.jobs.get(job_id)
+
+    def list(self) -> List[BuildJob]:
+        with self._lock:
+            self._evict_finished()
+            jobs = list(self.jobs.values())
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    def _evict_finished(self):
+        """删除超过保留时间的已结束任务，已结束的任务超过 max_finished 个时删除最早结束的（调用方持有 _lock）"""
+        now = time.time()
+        finished = sorted((job for job in self.jobs.values() if job.status in FINISHED_STATES),
+                          key=lambda job: job.finished_at or job.created_at)
+        expired = [job for job in finished if now - (job.finished_at or job.created_at) > self.job_ttl]
+        expired += finished[len(expired):max(len(expired), len(finished) - self.max_finished)]
+        for job in expired:
+            self.jobs.pop(job.job_id, None)
+
+    def _doc_lock(self, doc_name: str, acquire: bool) -> threading.Lock:
+        """登记或注销对文档锁的使用，返回该文档的锁"""
+        with self._lock:
+            entry = self._doc_locks.setdefault(doc_name, [threading.Lock(), 0])
+            entry[1] += 1 if acquire else -1
+            if entry[1] <= 0:
+                del self._doc_locks[doc_name]
+            return entry[0]
+
+    def cancel(self, job_id: str) -> Optional[BuildJob]:
+        """请求取消任务；排队中的任务直接取消，运行中的任务在下一个分块前停止"""
+        job = self.jobs.get(job_id)
+        if job is None or job.status in FINISHED_STATES:
+            return job
+        job.cancel_event.set()
+        if job.status == JOB_PENDING:
+            job.status = JOB_CANCELLED
+            job.stage = "cancelled"
+            job.finished_at = time.time()
+        return job
+
+    def _run(self, job: BuildJob):
+        # 同一文档的任务逐个执行，避免并发写同一份构建清单与分块结果
+        doc_name = os.path.splitext(job.file_name)[0]
+        doc_lock = self._doc_lock(doc_name, acquire=True)
+        try:
+            with doc_lock:
+                self._run_locked(job)
+        finally:
+            self._doc_lock(doc_name, acquire=False)
+
+    def _run_locked(self, job: BuildJob):
+        if job.cancel_event.is_set():
+            # 排队期间已被取消
+            if os.path.exists(job.file_path):
+                os.remove(job.file_path)
+            return
+
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        try:
+            pdf_service = PDFService()
+            kg_build_service = KGBuildService()
+
+            # 1. 解析PDF内容并保存预处理结果
+            job.update_progress("pdf2md")
+            # 根据文件名创建预处理子文件夹
+            file_name_without_extension = os.path.splitext(job.file_name)[0]
+            preprocess_file_dir = os.path.join("doc_preprocessed", file_name_without_extension)
+            os.makedirs(preprocess_file_dir, exist_ok=True)
+
+            # 逐页写入临时文件，不在内存中保存整个文档
+            tmp_path = os.path.join(preprocess_file_dir, f".{job.job_id}.md.tmp")
+            try:
+                pdf_service.write_markdown(job.file_path, tmp_path, document_name=job.file_name)
+            except Exception as e:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise ValueError("PDF解析失败") from e
+            if job.cancel_event.is_set():
+                os.remove(tmp_path)
+                job.status = JOB_CANCELLED
+                job.stage = "cancelled"
+                return
+
+            # 内容与最近一次预处理结果相同时直接复用，否则生成带时间戳的预处理文件
+            preprocessed_filename = find_identical_preprocessed(preprocess_file_dir, tmp_path)
+            if preprocessed_filename is None:
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                preprocessed_filename = f"{file_name_without_extension}_{timestamp}.md"
+                os.replace(tmp_path, os.path.join(preprocess_file_dir, preprocessed_filename))
+            else:
+                os.remove(tmp_path)
+            preprocessed_path = os.path.join(preprocess_file_dir, preprocessed_filename)
+            job.preprocessed_file = preprocessed_filename
+
+            # 2. 构建知识图谱，json 文件夹包含了模型抽取节点与关系的结果
+            kg_output_file_dir = os.path.join("kg_output", file_name_without_extension)
+            os.makedirs(kg_output_file_dir, exist_ok=True)
+
+            result = kg_build_service.build_graph(
+                kg_output_file_dir, preprocessed_path, job.prompt, job.database_name,
+                max_workers=job.max_workers,
+                progress=job.update_progress,
+                cancel_event=job.cancel_event,
+                use_cache=job.use_cache,
+                hedge=job.hedge,
+                compact=job.compact,
+            )
+            job.stats = result.get("stats", {})
+
+            if result.get("cancelled"):
+                job.status = JOB_CANCELLED
+                job.stage = "cancelled"
+            elif result.get("success"):
+                job.status = JOB_SUCCEEDED
+                job.stage = "done"
+            else:
+                job.status = JOB_FAILED
+                job.error = result.get("error")
+        except Exception as e:
+            job.status = JOB_FAILED
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            # 清理临时文件
+            if os.path.exists(job.file_path):
+                os.remove(job.file_path)
+
+
+load_dotenv()
+# 全局构建任务管理器，BUILD_JOB_WORKERS 限制同时运行的构建任务数
+# BUILD_JOB_TTL_SECONDS 与 BUILD_JOB_MAX_FINISHED 限制已结束任务的保留时间与数量
+build_job_manager = BuildJobManager(max_workers=int(os.getenv("BUILD_JOB_WORKERS", "2")),
+                                    job_ttl=float(os.getenv("BUILD_JOB_TTL_SECONDS", "86400")),
+                                    max_finished=int(os.getenv("BUILD_JOB_MAX_FINISHED", "200")))
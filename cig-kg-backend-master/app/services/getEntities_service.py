@@ -4,6 +4,7 @@ from typing import List, Optional, Dict, Any
 import json
 import os
 from datetime import datetime
+from app.utils.build_manifest import MANIFEST_NAME
 
 router = APIRouter()
 
@@ -45,7 +46,7 @@ def read_all_json_files(directory: str) -> List[Dict]:
 
     # 遍历目录下的所有文件
     for filename in os.listdir(directory):
-        if filename.endswith('.json'):
+        if filename.endswith('.json') and filename != MANIFEST_NAME:
             filepath = os.path.join(directory, filename)
             try:
                 with open(filepath, 'r', encoding='utf-8') as f:
@@ -1,14 +1,27 @@
 import json
+import math
 import os
+import queue
 import re
-from typing import Dict, Any, List
-from dotenv import load_dotenv
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, FIRST_COMPLETED, wait
+from typing import Dict, Any, List, Optional, Callable
 from fastapi import Depends
-from openai import OpenAI
 from app.dependencies.dependencies import get_neo4j_service
 from app.services.neo4j_service import Neo4jService
 from app.utils import id_assign, text_split
+from app.utils.compact_schema import get_compact_schema
+from app.utils.build_manifest import BuildManifest, chunk_file_name, chunk_source
+from app.utils.dedup_index import get_dedup_index
+from app.utils.llm_cache import get_llm_cache
+from app.utils.llm_backends import LLMBackend, get_backend_pool
+from app.utils.llm_scheduler import get_llm_scheduler, estimate_tokens
 from app.utils.neo4j_importer import Neo4jImporter
+from app.utils.structure_extractor import advance_headings, link_structure, semantic_prompt
+from app.utils.table_extractor import extract_tables
+from app.utils.token_budget import get_model_budget
 
 
 def save_kg_data(index, data: Dict[str, Any], output_dir: str = "kg_output/deepseek"):
@@ -24,113 +37,542 @@ def save_kg_data(index, data: Dict[str, Any], output_dir: str = "kg_output/deeps
     return output_path
 
 
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """最近秩法计算百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(p / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class TruncatedOutputError(Exception):
+    """模型输出因长度限制被截断，JSON 不完整"""
+    pass
+
+
+def parse_kg_output(content: str, finish_reason: Optional[str]) -> Dict[str, Any]:
+    """解析模型输出的 JSON，输出被截断时抛出 TruncatedOutputError"""
+    if finish_reason == "length":
+        raise TruncatedOutputError("模型输出达到 max_tokens 上限")
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError as e:
+        # 解析错误出现在文本末尾，或字符串未闭合，都说明输出在中途被截断
+        if e.pos >= len(content.rstrip()) - 1 or e.msg.startswith("Unterminated string"):
+            raise TruncatedOutputError(f"模型输出不完整: {e}") from e
+        raise
+
+
+def cached_prompt_tokens(usage) -> int:
+    """读取命中服务端前缀缓存的输入 token 数
+
+    OpenAI/vLLM 返回 usage.prompt_tokens_details.cached_tokens，DeepSeek 返回 usage.prompt_cache_hit_tokens。
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached is None:
+        cached = getattr(usage, "prompt_cache_hit_tokens", None)
+    return cached or 0
+
+
+class BuildCancelledError(Exception):
+    """构建任务被取消"""
+    pass
+
+
 class KGBuildService:
     def __init__(self, neo4j_service: Neo4jService = Depends(get_neo4j_service)):
-        load_dotenv()
-
         self.model_name = os.getenv("MODEL_NAME", "MODEL_NAME") # autodl-tmp/models/Qwen2.5-7B-Instruct
 
         self.neo4j_service = neo4j_service
-        self.client = OpenAI(
-            api_key=os.getenv("API_KEY", "API_KEY"),
-            base_url=os.getenv("BASE_URL", "BASE_URL")
-        )
+        # 进程内共享的模型端点池（各端点复用共享连接池），重试交由调度器统一处理
+        self.backend_pool = get_backend_pool()
+        self.scheduler = get_llm_scheduler()
         self.conversation_history = []  # 维护对话历史
+        self._history_lock = threading.Lock()  # 并发抽取时保护对话历史
+        # 并发抽取时同时在途的LLM请求数，1 表示按顺序逐块抽取
+        self.max_workers = int(os.getenv("EXTRACT_MAX_WORKERS", "1"))
+        self.cache = get_llm_cache()
+        self.dedup_index = get_dedup_index()
+        # 单次构建的统计信息，build_graph 开始时重置
+        self.stats = {}
+        self.latencies = []
+        self._stats_lock = threading.Lock()
+        # 对冲请求：主请求超过近期耗时的 hedge_percentile 分位仍未返回时，向另一端点补发一次
+        self.hedge = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+        self.hedge_percentile = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+        self.hedge_max_ratio = float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1"))  # 补发次数占请求数的上限
+        self._latency_window = deque(maxlen=200)
+        # 输出截断时递归拆分分块的最大层数
+        self.max_split_depth = int(os.getenv("EXTRACT_MAX_SPLIT_DEPTH", "3"))
+        # 紧凑输出：模型按提示词生成的类型代码表输出位置数组，抽取后还原为 nodes/relationships
+        self.compact_output = os.getenv("LLM_COMPACT_OUTPUT", "false").lower() == "true"
+        # 分块方式：tokens 按模型的输入/输出 token 预算分块，chars 为按 3000 字符分块
+        self.chunk_strategy = os.getenv("CHUNK_STRATEGY", "tokens")
+        self.token_budget = get_model_budget(self.model_name)
+        # 已识别版式的表格（信号表、缩写索引、参数表、页眉页脚）按规则转换，不发给大模型
+        self.table_extraction = os.getenv("TABLE_EXTRACTION_ENABLED", "true").lower() == "true"
+        # 标题、图片与参见按规则识别，大模型只抽取语义实体（提示词中去掉这些类型的定义）
+        self.structure_extraction = os.getenv("STRUCTURE_EXTRACTION_ENABLED", "true").lower() == "true"
+        self._hedge_executor = None
+
+    def _count(self, key: str, n: int = 1):
+        """线程安全地累加构建统计"""
+        with self._stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + n
+
+    def _send(self, backend: LLMBackend, messages: List[Dict[str, str]]):
+        """在已选定的端点上发起一次请求，并把耗时与成败反馈给端点池"""
+        started = time.time()
+        try:
+            # TODO: 替换为本地部署的qwen模型，可能需要禁用response_format并对输出作json化处理
+            response = backend.client.chat.completions.create(
+                model=backend.model,
+                messages=messages,
+                response_format={'type': 'json_object'},
+                max_tokens=self.token_budget.max_output_tokens,
+            )
+        except Exception as e:
+            self.backend_pool.release(backend, time.time() - started, success=False, error=e)
+            raise
+        self.backend_pool.release(backend, time.time() - started, success=True)
+        return response
+
+    def _chat_completion(self, messages: List[Dict[str, str]], estimated_tokens: int = 0):
+        """在负载最低的健康端点上发起一次请求，必要时对冲，并记录耗时
+
+        只有一个端点时不对冲：补发只会落在同一端点上。
+        """
+        started = time.time()
+        primary = self.backend_pool.acquire()
+        if self.hedge and self._hedge_executor is not None and len(self.backend_pool.backends) > 1:
+            response = self._hedged_send(primary, messages, estimated_tokens)
+        else:
+            response = self._send(primary, messages)
+        latency = time.time() - started
+        with self._stats_lock:
+            self.latencies.append(latency)
+            self._latency_window.append(latency)
+        return response
+
+    def _hedged_send(self, primary: LLMBackend, messages: List[Dict[str, str]], estimated_tokens: int = 0):
+        """主请求超过耗时分位数仍未返回且预算允许时，向另一端点补发，取先成功的结果
+
+        补发请求不经主请求的调度名额，需另从调度器不等待地取得并发名额与 RPM/TPM 配额，取不到时不补发。
+        落后的请求无法中途取消，会在后台跑完并照常释放端点与调度名额。
+        """
+        primary_future = self._hedge_executor.submit(self._send, primary, messages)
+        with self._stats_lock:
+            window = list(self._latency_window)
+        if len(window) < 10:  # 样本不足时不对冲
+            return primary_future.result()
+        try:
+            return primary_future.result(timeout=percentile(window, self.hedge_percentile))
+        except FuturesTimeoutError:
+            pass
+
+        with self._stats_lock:
+            budget = self.hedge_max_ratio * max(self.stats.get("llm_calls", 0), 1)
+            if self.stats.get("hedged_requests", 0) + 1 > budget:
+                return primary_future.result()
+            self.stats["hedged_requests"] = self.stats.get("hedged_requests", 0) + 1
+        if not self.scheduler.try_reserve(estimated_tokens):
+            self._count("hedged_requests", -1)
+            return primary_future.result()
+
+        def send_backup():
+            try:
+                return self._send(self.backend_pool.acquire(exclude=primary), messages)
+            finally:
+                self.scheduler.release_reserved()
+
+        hedge_future = self._hedge_executor.submit(send_backup)
+        pending = {primary_future, hedge_future}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge_future:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def extract_kg_elements(self, text: str, prompt: str, use_cache: bool = True, depth: int = 0,
+                            context: str = "") -> Dict[str, Any]:
 
-    def extract_kg_elements(self, text: str, prompt: str) -> Dict[str, Any]:
+        """从文本中提取知识图谱元素，use_cache 为 False 时跳过结果缓存
 
-        """从文本中提取知识图谱元素"""
+        context 为附加在文本前的所属章节等上下文。输出被截断时在段落边界处将文本一分为二，
+        每一半前都附加 context 后分别抽取再合并，最多递归 max_split_depth 层。
+        """
         system_prompt = """你是一个文档处理专家并擅长构建知识图谱"""
-        user_prompt = f"{prompt}\n\n待处理文本：\n{text}"
+        schema = None
+        # 递归拆分时传入原始 prompt，格式说明只追加一次
+        full_prompt = prompt
+        if self.compact_output:
+            schema = get_compact_schema(prompt)
+            full_prompt = f"{prompt}\n\n{schema.instructions()}"
+        # 提示词与格式说明放在系统消息中，作为各分块请求逐字节相同的前缀，便于服务端前缀缓存命中；
+        # 只有末尾的待处理文本随分块变化
+        static_prefix = f"{system_prompt}\n\n{full_prompt}"
+        full_text = context + text
+        user_prompt = f"待处理文本：\n{full_text}"
+
+        cache_key = self.cache.make_key(self.model_name, system_prompt, full_prompt, full_text)
+        if use_cache:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self._count("cache_hits")
+                return cached
+
+        # 近重复分块（重复的安全警告、诊断信息等）复用已有抽取结果，ID 由调用方重新分配
+        signature = None
+        if self.dedup_index is not None:
+            scope = self.dedup_index.make_scope(self.model_name, system_prompt, full_prompt)
+            signature = self.dedup_index.signature(full_text)
+            if signature is not None and use_cache:
+                duplicate = self.dedup_index.query(scope, signature)
+                if duplicate is not None:
+                    self._count("near_duplicate_hits")
+                    print(f"命中近重复分块（相似度 {duplicate[0]:.2f}），跳过大模型调用")
+                    return duplicate[1]
 
         # TODO: 启用历史对话的效果不佳
         # 仅保留上轮对话（如果有）
         last_conversation = self.conversation_history[-2:] if self.conversation_history else []
         # 构建包含历史对话的messages
         messages = [
-            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": static_prefix},
             # *last_conversation,  # 仅注入上轮对话
             {"role": "user", "content": user_prompt}
         ]
 
-        # TODO: 替换为本地部署的qwen模型，可能需要禁用response_format并对输出作json化处理
-        response = self.client.chat.completions.create(
-            model=self.model_name,
-            messages=messages,
-            response_format={'type': 'json_object'},
-            max_tokens=8192,
+        # 经共享调度器限流与重试，重试时会重新选择端点；预估 token 数按输入加上与分块等长的输出计算
+        request_tokens = estimate_tokens(static_prefix) + estimate_tokens(user_prompt) + estimate_tokens(full_text)
+        response = self.scheduler.call(
+            lambda: self._chat_completion(messages, request_tokens),
+            estimated_tokens=request_tokens
         )
 
-        result = json.loads(response.choices[0].message.content)
+        self._count("llm_calls")
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self._count("prompt_tokens", usage.prompt_tokens or 0)
+            self._count("completion_tokens", usage.completion_tokens or 0)
+            self._count("cached_prompt_tokens", cached_prompt_tokens(usage))
+        try:
+            result = parse_kg_output(response.choices[0].message.content, response.choices[0].finish_reason)
+            if schema is not None:
+                result = schema.expand(result)
+        except TruncatedOutputError as e:
+            halves = text_split.split_in_half(text)
+            if halves is None or depth >= self.max_split_depth:
+                raise
+            print(f"{e}，拆分为 {len(halves[0])}+{len(halves[1])} 字符后重新抽取")
+            self._count("truncated_splits")
+            result = id_assign.merge_kg_data([
+                self.extract_kg_elements(half, prompt, use_cache=use_cache, depth=depth + 1, context=context)
+                for half in halves
+            ])
+        # 绕过缓存时仍写入最新结果，便于后续构建复用
+        self.cache.put(cache_key, result)
+        if signature is not None:
+            self.dedup_index.add(scope, signature, result)
         # 更新对话历史（仅保留最新一轮）
-        self.conversation_history = [
-                                        *last_conversation,
-                                        {"role": "user", "content": user_prompt},  # 截断保存
-                                        {"role": "assistant", "content": json.dumps(result)}
-                                    ][-2:]  # 严格限制只保留1轮完整对话
+        with self._history_lock:
+            self.conversation_history = [
+                                            *last_conversation,
+                                            {"role": "user", "content": user_prompt},  # 截断保存
+                                            {"role": "assistant", "content": json.dumps(result)}
+                                        ][-2:]  # 严格限制只保留1轮完整对话
 
         return result
 
-    # TODO: 按页处理文件，定义一个全局变量页码，将其与每页抽取实体建立指向关系；将抽取结果合并到main中
-    def build_graph(self, json_dir: str, file_path: str, prompt: str, database_name: str) -> Dict[str, Any]:
-        """构建知识图谱"""
-        try:
+    def llm_prompt(self, prompt: str) -> str:
+        """实际发给大模型的提示词：启用规则识别时去掉标题、图片与参见的定义"""
+        return semantic_prompt(prompt) if self.structure_extraction else prompt
+
+    def extraction_options(self) -> str:
+        """影响抽取结果的开关，计入构建清单的分块哈希，开关变化后续建时重新抽取"""
+        return (f"compact={self.compact_output};tables={self.table_extraction};"
+                f"structure={self.structure_extraction}")
+
+    def split_chunks(self, file_path: str, prompt: str):
+        """按 CHUNK_STRATEGY 对预处理文件分块
+
+        启用规则识别时在分块的 metadata["heading_stack"] 中记录分块开头所属的上级标题。
+        """
+        if self.chunk_strategy == "chars":
+            chunks = text_split.iter_text_split(file_path)
+        else:
+            llm_prompt = self.llm_prompt(prompt)
+            if self.compact_output:
+                llm_prompt = f"{llm_prompt}\n\n{get_compact_schema(llm_prompt).instructions()}"
+            if self.chunk_strategy == "headings":
+                # 标题路径依赖全文的标题树，整篇读入后分块
+                chunks = text_split.text_split_by_tokens(file_path, self.model_name, llm_prompt,
+                                                         compact=self.compact_output, by_headings=True)
+            else:
+                chunks = text_split.iter_text_split_by_tokens(file_path, self.model_name, llm_prompt,
+                                                              compact=self.compact_output)
+        if not self.structure_extraction:
+            return chunks
+        return self._with_heading_stack(chunks, prompt)
+
+    @staticmethod
+    def _with_heading_stack(chunks, prompt: str):
+        stack = []
+        for chunk in chunks:
+            chunk.metadata["heading_stack"] = stack
+            stack = advance_headings(stack, chunk.page_content, prompt)
+            yield chunk
+
+    def _process_chunk(self, index: int, chunk, chunks_count: Optional[int], prompt: str, json_dir: str,
+                       cancel_event: Optional[threading.Event] = None, use_cache: bool = True,
+                       manifest: Optional[BuildManifest] = None) -> Optional[Dict[str, Any]]:
+        """抽取单个分块并按分块序号保存结果，返回分配ID后的数据
+
+        清单中已抽取且内容未变的分块直接跳过并返回 None，需要时从结果文件读取。
+        chunks_count 为分块总数，分块阶段尚未结束时为 None。
+        """
+        if cancel_event is not None and cancel_event.is_set():
+            raise BuildCancelledError("构建任务已取消")
+        # 按标题树分块时在文本前附加所属章节路径
+        text = text_split.chunk_text_with_context(chunk)
+        chunk_hash = BuildManifest.chunk_hash(self.model_name, prompt, text, self.extraction_options())
+        if manifest is not None and use_cache and manifest.is_extracted(index, chunk_hash):
+            self._count("chunks_resumed")
+            print(f"{index}/{chunks_count or '?'}----Skipped (already extracted)")
+            return None
+        print(f"{index}/{chunks_count or '?'}----Processing---")
+        print(chunk)
+        content = chunk.page_content
+        table_data = None
+        if self.table_extraction:
+            table_data, content, tables = extract_tables(content, prompt)
+            self._count("tables_extracted", tables)
+            self._count("table_nodes", len(table_data["nodes"]))
+        if text_split.is_blank_text(content):
+            # 没有文字的分块（如未识别的扫描页，或只有已转换的表格）不调用大模型
+            self._count("empty_chunks_skipped")
+            kg_data = {"nodes": [], "relationships": []}
+        else:
+            kg_data = self.extract_kg_elements(text=content, prompt=self.llm_prompt(prompt), use_cache=use_cache,
+                                               context=text_split.heading_context(chunk))
+        if table_data is not None and table_data["nodes"]:
+            kg_data = id_assign.merge_kg_data([table_data, kg_data])
+        if self.structure_extraction:
+            # 在原文上定位标题、图片与参见，并把表格与大模型抽取的实体连接到所在的标题
+            kg_data, structure_nodes = link_structure(chunk.page_content, kg_data, prompt,
+                                                      chunk.metadata.get("heading_stack"))
+            self._count("structure_nodes", structure_nodes)
+        # 按页分块时在每个节点上记录来源页码，溯源时直接读取节点属性
+        pages = chunk.metadata.get("pages") if getattr(chunk, "metadata", None) else None
+        if pages:
+            source_pages = list(range(pages[0], pages[1] + 1))
+            for node in kg_data["nodes"]:
+                node.setdefault("properties", {})["来源页码"] = source_pages
+
+        # 为每个节点赋予全局唯一ID
+        data = id_assign.replace_ids_with_random(kg_data)
+        save_kg_data(data=data, index=index, output_dir=json_dir)
+        if manifest is not None:
+            manifest.mark_extracted(index, chunk_hash)
+        print(f"{index}----Processed")
+        return data
+
+    # TODO: 将抽取结果合并到main中
+    def build_graph(self, json_dir: str, file_path: str, prompt: str, database_name: str,
+                    max_workers: Optional[int] = None,
+                    progress: Optional[Callable[[str, int, int], None]] = None,
+                    cancel_event: Optional[threading.Event] = None,
+                    use_cache: bool = True,
+                    hedge: Optional[bool] = None,
+                    compact: Optional[bool] = None) -> Dict[str, Any]:
+        """构建知识图谱
+
+        构建按 分块 -> 抽取与ID分配 -> 导入Neo4j 三个阶段流水执行，阶段之间以有界队列相连，
+        每个分块抽取完成后立即导入，队列满时上游阶段阻塞等待，内存占用与文档大小无关。
+        max_workers 为同时在途的抽取请求数上限，未指定时取 EXTRACT_MAX_WORKERS；
+        无论是否并发，分块结果都按分块序号保存为 000.json、001.json ...
+        progress(stage, done, total) 用于上报进度，分块流式产出，分块阶段结束前 total 为 None，cancel_event 被置位后在下一个分块前停止。
+        json_dir 下的构建清单记录各分块的抽取与导入状态，中断后重新提交只抽取缺失或内容变化的分块，
+        只导入尚未导入目标数据库的分块；use_cache 为 False 时忽略清单与缓存，所有分块都重新调用大模型。
+        hedge 为是否启用对冲请求，未指定时取 LLM_HEDGE_ENABLED；返回的 stats 中包含请求耗时的 p50/p95/p99。
+        compact 为是否使用紧凑输出格式，未指定时取 LLM_COMPACT_OUTPUT。
+        """
+        def report(stage: str, done: int = 0, total: Optional[int] = None):
+            if progress is not None:
+                progress(stage, done, total)
 
-            chunks = text_split.text_split(file_path=file_path)
-            chunks_count = len(chunks)
-            self.conversation_history = []  # 新文件处理时重置历史
-
-            page_index = 0  # 全局页码
-
-            # 1. 提取知识图谱元素
-            for index, chunk in enumerate(chunks):
-                print(f"{index}/{chunks_count}----Processing---")
-                print(chunk)
-                kg_data = self.extract_kg_elements(text=chunk.page_content, prompt=prompt)
-                # TODO:按页分块时启用
-                # page_index = page_index + 1
-                # new_node = {
-                #     "id": "0",
-                #     "type": "页码",
-                #     "properties": {
-                #         "实体名": str(page_index)
-                #     }
-                # }
-                # kg_data["nodes"].append(new_node)  # 将新节点添加到nodes列表中
-                #
-                # # 为新节点创建指向现有所有节点的关系
-                # existing_node_ids = [node["id"] for node in kg_data["nodes"] if node["id"] != "0"]  # 获取现有节点的id，排除新添加的节点
-                # new_relationships = [
-                #     {
-                #         "type": "有实体",
-                #         "from": "0",  # 新节点的id
-                #         "to": node_id
-                #     } for node_id in existing_node_ids
-                # ]
-                # kg_data["relationships"].extend(new_relationships)  # 将新关系添加到relationships列表中
-
-                # 为每个节点赋予全局唯一ID
-                data = id_assign.replace_ids_with_random(kg_data)
-                save_kg_data(data=data, index=index, output_dir=json_dir)
-                print(f"{index}----Processed")
-
-            # 2. 保存到Neo4j
+        self.conversation_history = []  # 新文件处理时重置历史
+        self.stats = {"llm_calls": 0, "cache_hits": 0, "chunks_resumed": 0, "chunks_imported": 0,
+                      "hedged_requests": 0, "hedge_wins": 0, "truncated_splits": 0,
+                      "near_duplicate_hits": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                      "cached_prompt_tokens": 0, "empty_chunks_skipped": 0, "tables_extracted": 0,
+                      "table_nodes": 0, "structure_nodes": 0}
+        self.latencies = []
+        workers = max(1, max_workers or self.max_workers)
+        if hedge is not None:
+            self.hedge = hedge
+        if compact is not None:
+            self.compact_output = compact
+        if self.hedge:
+            # 主请求与补发请求都在该线程池中执行
+            self._hedge_executor = ThreadPoolExecutor(max_workers=workers * 2, thread_name_prefix="kg-hedge")
+        manifest = BuildManifest(json_dir)
+
+        chunk_queue = queue.Queue(maxsize=workers * 2)  # 分块 -> 抽取
+        import_queue = queue.Queue(maxsize=workers * 2)  # 抽取 -> 导入
+        failed = threading.Event()  # 任一阶段出错后，上游停止产出新分块
+        errors = []
+        # total 在分块阶段结束后才确定，此前为 None
+        counter = {"total": None, "extracted": 0}
+        counter_lock = threading.Lock()
+
+        def fail(e: Exception):
+            errors.append(e)
+            failed.set()
+
+        def put(q: queue.Queue, item) -> bool:
+            """阻塞写入队列（背压），出错后放弃写入"""
+            while not failed.is_set():
+                try:
+                    q.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def chunk_stage():
+            try:
+                count = 0
+                for index, chunk in enumerate(self.split_chunks(file_path, prompt)):
+                    if not put(chunk_queue, (index, chunk)):
+                        break
+                    count = index + 1
+                else:
+                    with counter_lock:
+                        counter["total"] = count
+            except Exception as e:
+                fail(e)
+            finally:
+                # 每个抽取线程一个结束标记，不受 failed 影响
+                for _ in range(workers):
+                    chunk_queue.put(None)
+
+        def extract_stage():
+            while True:
+                item = chunk_queue.get()
+                if item is None:
+                    break
+                if failed.is_set():
+                    continue  # 排空队列
+                index, chunk = item
+                try:
+                    data = self._process_chunk(index, chunk, counter["total"], prompt, json_dir,
+                                               cancel_event, use_cache, manifest)
+                    with counter_lock:
+                        counter["extracted"] += 1
+                        report("extracting", counter["extracted"], counter["total"])
+                    put(import_queue, (index, data))
+                except Exception as e:
+                    fail(e)
+
+        def import_stage():
             importer = Neo4jImporter(database=database_name)
-            print(f"saving to {database_name}...")
-            importer.batch_import_to_neo4j(json_dir=json_dir)
+            drained = False
+            try:
+                while True:
+                    item = import_queue.get()
+                    if item is None:
+                        drained = True
+                        break
+                    index, data = item
+                    if manifest.is_imported(index, database_name):
+                        continue
+                    if data is None:
+                        # 续建时跳过抽取的分块，从结果文件读取
+                        with open(os.path.join(json_dir, chunk_file_name(index)), "r", encoding="utf-8") as f:
+                            data = json.load(f)
+                    source = chunk_source(json_dir, chunk_file_name(index))
+                    if manifest.has_stale_import(index, database_name):
+                        # 分块重新抽取过，先删除此前导入的旧结果
+                        importer.delete_source(source)
+                    importer.import_data(data, source)
+                    manifest.mark_imported(index, database_name)
+                    self._count("chunks_imported")
+                # 所有分块导入后合并重复节点
+                if self.stats["chunks_imported"] > 0:
+                    importer.merge_duplicate_nodes()
+            except Exception as e:
+                fail(e)
+                # 继续排空队列，避免抽取线程阻塞
+                while not drained and import_queue.get() is not None:
+                    pass
+            finally:
+                importer.close()
+
+        try:
+            report("extracting", 0, None)
+            print(f"building {file_path} with {workers} extraction workers, saving to {database_name}...")
+            chunk_thread = threading.Thread(target=chunk_stage, name="kg-chunk", daemon=True)
+            extract_threads = [threading.Thread(target=extract_stage, name=f"kg-extract-{i}", daemon=True)
+                               for i in range(workers)]
+            import_thread = threading.Thread(target=import_stage, name="kg-import", daemon=True)
+            import_thread.start()
+            for thread in extract_threads:
+                thread.start()
+            chunk_thread.start()
+
+            chunk_thread.join()
+            for thread in extract_threads:
+                thread.join()
+            import_queue.put(None)
+            report("importing", counter["extracted"], counter["total"])
+            import_thread.join()
             # TODO: 同时保存到main中
-            # importer.database = 'main'
-            # importer.batch_import_to_neo4j(json_dir=json_dir)
 
+            if errors:
+                raise errors[0]
+            # 文档变短时清理多余分块
+            manifest.truncate(counter["total"] or 0)
 
+            stats = dict(self.stats)
+            stats["prompt_cache_hit_ratio"] = round(stats["cached_prompt_tokens"] / stats["prompt_tokens"], 3) \
+                if stats["prompt_tokens"] else None
+            for p in (50, 95, 99):
+                value = percentile(self.latencies, p)
+                stats[f"latency_p{p}"] = round(value, 2) if value is not None else None
+            print(f"llm calls: {stats['llm_calls']}, cache hits: {stats['cache_hits']}, "
+                  f"near-duplicate hits (saved calls): {stats['near_duplicate_hits']}, "
+                  f"resumed chunks: {stats['chunks_resumed']}, hedged: {stats['hedged_requests']}, "
+                  f"prompt/cached/completion tokens: {stats['prompt_tokens']}/{stats['cached_prompt_tokens']}/"
+                  f"{stats['completion_tokens']}, "
+                  f"latency p50/p95/p99: {stats['latency_p50']}/{stats['latency_p95']}/{stats['latency_p99']}")
             return {
                 "success": True,
+                "stats": stats,
                 # "entity_count": sum(len(v) for v in kg_data["entities"].values()),
                 # "relation_count": len(kg_data["relations"])
             }
 
+        except BuildCancelledError as e:
+            return {
+                "success": False,
+                "cancelled": True,
+                "error": str(e)
+            }
         except Exception as e:
             return {
                 "success": False,
                 "error": str(e)
             }
+        finally:
+            if self._hedge_executor is not None:
+                # 不等待落后的对冲请求
+                self._hedge_executor.shutdown(wait=False)
+                self._hedge_executor = None
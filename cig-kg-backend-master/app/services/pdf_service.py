@@ -1,9 +1,112 @@
+import asyncio
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from PyPDF2 import PdfReader
-from typing import Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import pymupdf
 import pymupdf4llm
+from dotenv import load_dotenv
+
+from app.utils import text_split
+from app.utils.image_store import IMAGE_DIR, IMAGE_REF_PATTERN, get_image_manifest, store_image
+from app.utils.page_cache import PageCache, get_page_cache, page_hashes
+
+
+def page_ranges(page_count: int, pages_per_task: int) -> List[List[int]]:
+    """将页号（从 0 开始）按 pages_per_task 页一组切分为连续的页段"""
+    pages_per_task = max(1, pages_per_task)
+    return [list(range(start, min(start + pages_per_task, page_count)))
+            for start in range(0, page_count, pages_per_task)]
+
+
+def _store_range_images(image_paths: List[str]) -> Tuple[Dict[str, str], Dict[str, Dict[str, Any]]]:
+    """将转换时写出的图片按内容哈希移入 images/，返回 原路径 -> markdown 引用 与新图片的信息"""
+    references, infos = {}, {}
+    for image_path in image_paths:
+        name, info = store_image(image_path)
+        references[image_path] = f"{IMAGE_DIR}/{name}"
+        infos[name] = info
+    return references, infos
+
+
+def _parse_page_range(file_path: str, pages: List[int], image_format: Optional[str]):
+    """子进程中用版面分析引擎解析一个页段，返回各页序列化后的版面分析结果与新保存的图片信息
+
+    标题级别由主进程按全文的标题字号统一确定，因此缓存的是版面分析结果而不是 markdown；
+    image_format 不为空时图片区域写出后按内容哈希保存，版面分析结果中只保留 images/<哈希> 引用。
+    """
+    from pymupdf4llm.helpers import document_layout
+    from pymupdf4llm.ocr import OCRMode
+    with tempfile.TemporaryDirectory() as image_path:
+        # 参数与 pymupdf4llm.to_markdown 在版面分析模式下的默认值一致，但关闭其内置 OCR：
+        # 扫描页统一由 ocr_pages 按 PDF_OCR_* 配置识别，否则装有 Tesseract 时会在这里按默认的英文先识别并写入页缓存
+        parsed = document_layout.parse_document(file_path, pages=pages, force_text=True, use_ocr=OCRMode.NEVER,
+                                                write_images=image_format is not None,
+                                                image_path=image_path, image_format=image_format or "png")
+        boxes = [box for page in parsed.pages for box in page.boxes if isinstance(getattr(box, "image", None), str)]
+        references, infos = _store_range_images([box.image for box in boxes])
+    for box in boxes:
+        box.image = references[box.image]
+    return [pickle.dumps(page) for page in parsed.pages], infos
+
+
+def _convert_page_range(file_path: str, pages: List[int], hdr_info, image_format: Optional[str]):
+    """子进程中按全文统一的标题字号表转换一个页段，返回各页 markdown 与新保存的图片信息"""
+    with tempfile.TemporaryDirectory() as image_path:
+        chunks = pymupdf4llm.to_markdown(file_path, pages=pages, hdr_info=hdr_info, page_chunks=True,
+                                         write_images=image_format is not None,
+                                         image_path=image_path, image_format=image_format or "png")
+        image_paths = [os.path.join(image_path, name) for name in os.listdir(image_path)]
+        references, infos = _store_range_images(image_paths)
+    texts = []
+    for page in chunks:
+        text = page["text"]
+        for image_path, reference in references.items():
+            text = text.replace(image_path, reference)
+        texts.append(text.encode("utf-8"))
+    return texts, infos
+
+
+def _ocr_page_range(file_path: str, pages: List[int], language: str, dpi: int) -> List[bytes]:
+    """子进程中用 Tesseract 逐页识别一个页段，返回各页识别出的文本"""
+    texts = []
+    with pymupdf.open(file_path) as doc:
+        for index in pages:
+            page = doc[index]
+            textpage = page.get_textpage_ocr(language=language, dpi=dpi, full=True)
+            texts.append(page.get_text(textpage=textpage).encode("utf-8"))
+    return texts
+
+
+def tesseract_available() -> bool:
+    """MuPDF 的 OCR 需要本机安装 Tesseract 语言数据（或通过 TESSDATA_PREFIX 指定）"""
+    try:
+        return bool(pymupdf.get_tessdata())
+    except RuntimeError:
+        return False
 
 
 class PDFService:
+    def __init__(self):
+        load_dotenv()
+        # PDF_WORKERS 为 0 时使用全部 CPU 核，为 1 时在当前进程内串行转换
+        self.workers = int(os.getenv("PDF_WORKERS", "0")) or (os.cpu_count() or 1)
+        self.pages_per_task = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+        # 图片区域的输出格式，PDF_EXTRACT_IMAGES=false 时不提取图片
+        self.image_format = (os.getenv("PDF_IMAGE_FORMAT", "jpg")
+                             if os.getenv("PDF_EXTRACT_IMAGES", "true").lower() == "true" else None)
+        # 文本层字符数少于 PDF_OCR_MIN_CHARS 的页视为扫描页，只对这些页做 OCR
+        self.ocr_enabled = os.getenv("PDF_OCR_ENABLED", "true").lower() == "true"
+        self.ocr_language = os.getenv("PDF_OCR_LANGUAGE", "chi_sim+eng")
+        self.ocr_dpi = int(os.getenv("PDF_OCR_DPI", "300"))
+        self.ocr_min_chars = int(os.getenv("PDF_OCR_MIN_CHARS", "20"))
+        # OCR 每页耗时远高于转换，按更小的页段分配到各进程
+        self.ocr_pages_per_task = int(os.getenv("PDF_OCR_PAGES_PER_TASK", "2"))
+
     async def extract_text(self, file_path: str) -> Optional[str]:
         """提取PDF文本内容"""
         try:
@@ -13,14 +116,205 @@ class PDFService:
         except Exception:
             return None
 
-    def pdf2md(self, file_path: str) -> Optional[str]:
-        """提取PDF文本内容"""
+    def pdf2md(self, file_path: str, workers: Optional[int] = None,
+               document_name: Optional[str] = None) -> Optional[str]:
+        """提取PDF文本内容，每页开头写入页码标记用于按页分块与溯源"""
         try:
-            md_text = pymupdf4llm.to_markdown(file_path)
-            return md_text
+            return text_split.join_pages(self.convert_pages(file_path, workers, document_name))
         except Exception:
             return None
 
+    def write_markdown(self, file_path: str, output_path: str, workers: Optional[int] = None,
+                       document_name: Optional[str] = None) -> int:
+        """逐页转换并写入带页码标记的 markdown 文件，不在内存中保存整个文档，返回页数"""
+        page_count = 0
+        with open(output_path, "w", encoding="utf-8") as f:
+            for page in self.iter_pages(file_path, workers, document_name):
+                f.write(text_split.join_pages([page]))
+                page_count += 1
+        return page_count
+
+    def convert_pages(self, file_path: str, workers: Optional[int] = None,
+                      document_name: Optional[str] = None) -> List[Tuple[int, str]]:
+        """将PDF转换为按页排列的 (页码, markdown)"""
+        return list(self.iter_pages(file_path, workers, document_name))
+
+    def iter_pages(self, file_path: str, workers: Optional[int] = None,
+                   document_name: Optional[str] = None) -> Iterator[Tuple[int, str]]:
+        """按页序逐页生成 (页码, markdown)，内存占用与页数无关
+
+        各页按内容哈希查询逐页缓存，只转换未命中的页：重复上传或只改动少数页的修订版只需转换改动的页。
+        待转换的页按 PDF_PAGES_PER_TASK 分段，多于一段且 workers 大于 1 时在进程池中并行转换，
+        每段的结果随即写入逐页缓存（关闭缓存时写入临时库）；全部转换后按全文统计的标题字号逐页输出 markdown，
+        与串行转换的结果一致。图片按内容哈希保存在 images/ 下，并在图片清单中记录引用的文档页。
+        document_name 为图片清单中记录的文档名，应传入用户上传时的原始文件名，未传时取 file_path 的文件名。
+        """
+        workers = workers or self.workers
+        layout = getattr(pymupdf4llm, "_use_layout", False)
+        with pymupdf.open(file_path) as doc:
+            hashes = page_hashes(doc)
+            scanned = set(self._scanned_pages(doc)) if self.ocr_enabled else set()
+        if layout:
+            hdr_info = None
+            config = f"layout:{pymupdf4llm.__version__}:{self.image_format}"
+        else:
+            from pymupdf4llm.helpers.pymupdf_rag import IdentifyHeaders
+            hdr_info = IdentifyHeaders(file_path)
+            # 标题字号表随全文变化，纳入缓存键
+            config = (f"rag:{pymupdf4llm.__version__}:{self.image_format}:"
+                      f"{sorted(getattr(hdr_info, 'header_id', {}).items())}")
+
+        store = get_page_cache()
+        spill_dir = None
+        if store is None:
+            spill_dir = tempfile.mkdtemp(prefix="pdf_pages_")
+            store = PageCache(db_path=os.path.join(spill_dir, "pages.sqlite3"), max_bytes=1 << 62)
+        try:
+            keys = [PageCache.make_key(page_hash, config) for page_hash in hashes]
+            cached = store.contains_many(keys)
+            missing = [index for index, key in enumerate(keys) if key not in cached]
+            print(f"PDF转换：共 {len(keys)} 页，复用缓存 {len(keys) - len(missing)} 页")
+            image_infos = {}
+            if missing:
+                ranges = self._missing_ranges(missing)
+                for pages, (results, infos) in zip(ranges, self._convert_ranges(file_path, ranges, workers, hdr_info)):
+                    store.put_many({keys[index]: value for index, value in zip(pages, results)})
+                    image_infos.update(infos)
+
+            def load(index: int):
+                value = store.get(keys[index])
+                if value is None:
+                    # 文档超过缓存容量时前面的页可能已被淘汰，重新转换该页
+                    (results, infos), = self._convert_ranges(file_path, [[index]], 1, hdr_info)
+                    value = results[0]
+                    image_infos.update(infos)
+                return pickle.loads(value) if layout else value.decode("utf-8")
+
+            # 第一遍：统计全文的标题字号，找出转换后仍没有文字的扫描页
+            header_fontsizes = set()
+            blank_scanned = []
+            for index in range(len(keys)):
+                if not layout and index not in scanned:
+                    continue
+                page = load(index)
+                if layout:
+                    header_fontsizes.update(box.max_fontsize for box in page.boxes
+                                            if box.boxclass in ("title", "section-header"))
+                    if index in scanned and text_split.is_blank_text(
+                            self._render_layout_page(file_path, len(keys), index, page, set())):
+                        blank_scanned.append(index)
+                elif text_split.is_blank_text(page):
+                    blank_scanned.append(index)
+            # 扫描页用 OCR 结果补全，有文本层的页不做 OCR
+            ocr_texts = self.ocr_pages(file_path, blank_scanned, hashes, workers)
+
+            # 第二遍：逐页输出
+            document = document_name or os.path.basename(file_path)
+            sources = []
+            for index in range(len(keys)):
+                page = load(index)
+                md_text = self._render_layout_page(file_path, len(keys), index, page, header_fontsizes) \
+                    if layout else page
+                if index in ocr_texts:
+                    md_text = f"{md_text.rstrip()}\n\n{ocr_texts[index]}" if md_text.strip() else ocr_texts[index]
+                if self.image_format is not None:
+                    sources.extend((reference.split("/", 1)[1], document, index + 1)
+                                   for reference in IMAGE_REF_PATTERN.findall(md_text))
+                yield index + 1, md_text
+            if self.image_format is not None:
+                # 缓存命中的页引用的图片已在之前保存，这里只补充本文档的引用来源
+                get_image_manifest().update(image_infos, sources)
+        finally:
+            if spill_dir is not None:
+                store.close()
+                shutil.rmtree(spill_dir, ignore_errors=True)
+
+    def _scanned_pages(self, doc: pymupdf.Document) -> List[int]:
+        """返回没有文本层的页号（从 0 开始）"""
+        return [page.number for page in doc if len(page.get_text().strip()) < self.ocr_min_chars]
+
+    def ocr_pages(self, file_path: str, indices: List[int], hashes: List[str],
+                  workers: Optional[int] = None) -> Dict[int, str]:
+        """对指定页做 OCR，返回 页号 -> 识别文本
+
+        识别结果按页内容哈希缓存；未命中的页按 PDF_PAGES_PER_TASK 分段在进程池中并行识别。
+        """
+        if not indices:
+            return {}
+        if not tesseract_available():
+            print(f"PDF转换：{len(indices)} 页没有文本层，但未安装 Tesseract，跳过 OCR")
+            return {}
+        workers = workers or self.workers
+        cache = get_page_cache()
+        config = f"ocr:{self.ocr_language}:{self.ocr_dpi}"
+        keys = {index: PageCache.make_key(hashes[index], config) for index in indices}
+        found = cache.get_many(list(keys.values())) if cache is not None else {}
+        values = {index: found[key] for index, key in keys.items() if key in found}
+        missing = [index for index in indices if index not in values]
+        print(f"PDF转换：OCR {len(indices)} 页，复用缓存 {len(indices) - len(missing)} 页")
+        if missing:
+            ranges = self._missing_ranges(missing, self.ocr_pages_per_task)
+            extra = [[self.ocr_language] * len(ranges), [self.ocr_dpi] * len(ranges)]
+            for pages, results in zip(ranges, self._run_ranges(_ocr_page_range, file_path, ranges, workers, *extra)):
+                values.update(zip(pages, results))
+            if cache is not None:
+                cache.put_many({keys[index]: values[index] for index in missing})
+        return {index: values[index].decode("utf-8") for index in indices}
+
+    def _missing_ranges(self, missing: List[int], pages_per_task: Optional[int] = None) -> List[List[int]]:
+        """将待转换的页号按连续区间分组，每组再按 pages_per_task（默认 PDF_PAGES_PER_TASK）切分"""
+        pages_per_task = pages_per_task or self.pages_per_task
+        runs = []
+        for index in missing:
+            if runs and runs[-1][-1] == index - 1:
+                runs[-1].append(index)
+            else:
+                runs.append([index])
+        return [[run[0] + i for i in pages] for run in runs for pages in page_ranges(len(run), pages_per_task)]
+
+    def _convert_ranges(self, file_path: str, ranges: List[List[int]], workers: int, hdr_info) -> Iterator:
+        """按页段顺序逐个生成各页段的转换结果"""
+        if hdr_info is None:
+            func, extra = _parse_page_range, [[self.image_format] * len(ranges)]
+        else:
+            func, extra = _convert_page_range, [[hdr_info] * len(ranges), [self.image_format] * len(ranges)]
+        return self._run_ranges(func, file_path, ranges, workers, *extra)
+
+    @staticmethod
+    def _run_ranges(func, file_path: str, ranges: List[List[int]], workers: int, *extra) -> Iterator:
+        """按页段顺序逐个生成 func 的结果，只有一段或 workers 为 1 时在当前进程内串行执行"""
+        if workers <= 1 or len(ranges) <= 1:
+            yield from map(func, [file_path] * len(ranges), ranges, *extra)
+            return
+        # 构建任务运行在线程池中，fork 可能复制其他线程持有的锁，子进程统一用 spawn 启动
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(workers, len(ranges)), mp_context=context) as executor:
+            yield from executor.map(func, [file_path] * len(ranges), ranges, *extra)
+
+    @staticmethod
+    def _render_layout_page(file_path: str, page_count: int, index: int, page, header_fontsizes: set) -> str:
+        """按全文出现的标题字号确定标题级别后输出单页的版面分析结果"""
+        from pymupdf4llm.helpers import document_layout
+        # 缓存的页可能来自其他文档的不同位置
+        page.page_number = index + 1
+        if header_fontsizes:
+            document_layout.update_header_tags([page], header_fontsizes)
+        document = document_layout.ParsedDocument(filename=file_path, page_count=page_count, toc=[],
+                                                  metadata={}, pages=[page])
+        return document.to_markdown(header=True, footer=True, page_chunks=True)[0]["text"]
+
     async def ocr_text(self, file_path: str) -> Optional[str]:
-        pass
+        """提取PDF文本内容，有文本层的页直接读取，没有文本层的页用 OCR 识别；每页开头写入页码标记"""
+        try:
+            return await asyncio.to_thread(self._ocr_document, file_path)
+        except Exception:
+            return None
 
+    def _ocr_document(self, file_path: str) -> str:
+        with pymupdf.open(file_path) as doc:
+            hashes = page_hashes(doc)
+            texts = [page.get_text() for page in doc]
+            scanned = self._scanned_pages(doc)
+        for index, text in self.ocr_pages(file_path, scanned, hashes).items():
+            texts[index] = text
+        return text_split.join_pages([(index + 1, text) for index, text in enumerate(texts)])
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import List
+
+# 清单文件与分块结果放在同一目录，读取分块结果时需按文件名过滤
+MANIFEST_NAME = "_manifest.json"
+CHUNK_FILE_PATTERN = re.compile(r"^\d{3,}\.json$")
+
+
+def is_chunk_file(filename: str) -> bool:
+    """判断是否为 save_kg_data 保存的分块结果文件（000.json、001.json ...）"""
+    return CHUNK_FILE_PATTERN.match(filename) is not None
+
+
+def list_chunk_files(json_dir: str) -> List[str]:
+    """按分块序号列出目录下的分块结果文件"""
+    return sorted(f for f in os.listdir(json_dir) if is_chunk_file(f))
+
+
+def chunk_file_name(index: int) -> str:
+    return f"{index:03d}.json"
+
+
+def chunk_source(json_dir: str, filename: str) -> str:
+    """导入 Neo4j 时记录在节点与关系上的来源，如 X6_1/003.json，重新导入时据此删除旧数据"""
+    return f"{os.path.basename(os.path.normpath(json_dir))}/{filename}"
+
+
+class BuildManifest:
+    """记录 kg_output/<doc> 下每个分块的内容哈希、抽取与导入状态，用于断点续建
+
+    分块哈希包含模型名、提示词与抽取方式（紧凑输出、表格与规则识别等开关），任一变化时对应分块会重新抽取；
+    imported 记录该分块已导入的数据库，重新抽取后移入 replaced，这些数据库中的旧数据需在重新导入前删除。
+    """
+
+    def __init__(self, json_dir: str):
+        self.json_dir = json_dir
+        self.path = os.path.join(json_dir, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self.chunks = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.chunks = json.load(f).get("chunks", {})
+            except (json.JSONDecodeError, OSError) as e:
+                print(f"读取构建清单失败，将重新构建: {e}")
+
+    @staticmethod
+    def chunk_hash(model_name: str, prompt: str, text: str, options: str = "") -> str:
+        digest = hashlib.sha256()
+        for part in (model_name, prompt, text, options):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def is_extracted(self, index: int, chunk_hash: str) -> bool:
+        """分块已按相同内容抽取过且结果文件仍在"""
+        entry = self.chunks.get(chunk_file_name(index))
+        return (entry is not None
+                and entry.get("hash") == chunk_hash
+                and entry.get("extracted", False)
+                and os.path.exists(os.path.join(self.json_dir, chunk_file_name(index))))
+
+    def mark_extracted(self, index: int, chunk_hash: str):
+        with self._lock:
+            previous = self.chunks.get(chunk_file_name(index)) or {}
+            replaced = sorted(set(previous.get("replaced", [])) | set(previous.get("imported", [])))
+            self.chunks[chunk_file_name(index)] = {"hash": chunk_hash, "extracted": True, "imported": [],
+                                                   "replaced": replaced}
+            self._save()
+
+    def is_imported(self, index: int, database_name: str) -> bool:
+        entry = self.chunks.get(chunk_file_name(index))
+        return entry is not None and database_name in entry.get("imported", [])
+
+    def has_stale_import(self, index: int, database_name: str) -> bool:
+        """该分块重新抽取前的结果已导入过 database_name，重新导入前需先删除"""
+        entry = self.chunks.get(chunk_file_name(index))
+        return entry is not None and database_name in entry.get("replaced", [])
+
+    def mark_imported(self, index: int, database_name: str):
+        with self._lock:
+            entry = self.chunks.get(chunk_file_name(index))
+            if entry is None:
+                return
+            if database_name not in entry["imported"]:
+                entry["imported"].append(database_name)
+            if database_name in entry.get("replaced", []):
+                entry["replaced"].remove(database_name)
+            self._save()
+
+    def truncate(self, chunks_count: int):
+        """文档变短时删除多余分块的记录与结果文件"""
+        with self._lock:
+            for filename in list_chunk_files(self.json_dir):
+                if int(filename[:-len(".json")]) >= chunks_count:
+                    os.remove(os.path.join(self.json_dir, filename))
+            self.chunks = {name: entry for name, entry in self.chunks.items()
+                           if int(name[:-len(".json")]) < chunks_count}
+            self._save()
+
+    def _save(self):
+        """先写临时文件再替换，进程中途退出也不会留下损坏的清单"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"chunks": self.chunks}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
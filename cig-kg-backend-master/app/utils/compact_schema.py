@@ -0,0 +1,108 @@
+import re
+from functools import lru_cache
+from typing import Any, Dict, List
+
+ENTITY_PATTERN = re.compile(r"类型名称：\[([^\]\n]+)\][^\S\n]*\n[^\S\n]*属性列表：\[([^\]\n]*)\]")
+RELATION_PATTERN = re.compile(r"关系名称：\[([^\]\n]+)\]")
+NAME_PROPERTY = "实体名"
+
+
+class CompactSchema:
+    """紧凑输出格式的编码表，由提示词中的实体/关系类型定义生成
+
+    节点输出为 [id, 名称, 类型代码, 属性值...]，属性值按该类型属性列表（不含实体名）的顺序排列，
+    末尾可附加一个对象存放列表外的属性；关系输出为 [起点id, 终点id, 关系代码]，关系名与类型不同时附加关系名。
+    提示词中未定义的类型与关系直接输出名称。
+    """
+
+    def __init__(self, entity_types: Dict[str, List[str]], relation_types: List[str]):
+        self.entity_types = entity_types
+        self.relation_types = relation_types
+        self.entity_codes = {name: f"E{i}" for i, name in enumerate(entity_types, 1)}
+        self.relation_codes = {name: f"R{i}" for i, name in enumerate(relation_types, 1)}
+        self.entity_names = {code: name for name, code in self.entity_codes.items()}
+        self.relation_names = {code: name for name, code in self.relation_codes.items()}
+
+    @classmethod
+    def from_prompt(cls, prompt: str) -> "CompactSchema":
+        entity_types = {}
+        for name, properties in ENTITY_PATTERN.findall(prompt):
+            entity_types.setdefault(name.strip(), [p.strip() for p in re.split(r"[,，、]", properties) if p.strip()])
+        relation_types = list(dict.fromkeys(name.strip() for name in RELATION_PATTERN.findall(prompt)))
+        return cls(entity_types, relation_types)
+
+    def _positional_properties(self, type_name: str) -> List[str]:
+        return [p for p in self.entity_types.get(type_name, []) if p != NAME_PROPERTY]
+
+    def instructions(self) -> str:
+        """追加在提示词末尾的紧凑输出格式说明，替代原有的 JSON 结构要求"""
+        lines = [
+            "5. 紧凑输出格式（覆盖上文的输出结构要求）：",
+            '{"n": [[id, "名称", "类型代码", 属性值1, 属性值2, ...]], "r": [[起点id, 终点id, "关系代码"]]}',
+            "- 节点的属性值按下表中该类型的属性顺序排列，缺失填 null，末尾连续的 null 可省略；"
+            "表中未列出的属性放在最后一个对象中，如 {\"页码\": \"2-3\"}",
+            "- 表中没有的类型或关系直接写类型名或关系名；关系名与关系类型不同时在关系末尾附加关系名",
+            "- 只输出紧凑格式的纯JSON，不要换行缩进",
+        ]
+        if self.entity_codes:
+            lines.append("类型代码：")
+            for name, code in self.entity_codes.items():
+                properties = self._positional_properties(name)
+                lines.append(f"{code}={name}" + (f"（属性：{', '.join(properties)}）" if properties else ""))
+        if self.relation_codes:
+            lines.append("关系代码：")
+            lines.append("；".join(f"{code}={name}" for name, code in self.relation_codes.items()))
+        return "\n".join(lines)
+
+    def expand(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """将紧凑格式还原为 nodes/relationships 结构，已是原格式时原样返回"""
+        if "nodes" in data:
+            return data
+        nodes = []
+        for item in data.get("n", []):
+            node_id, name, code = item[0], item[1], item[2]
+            type_name = self.entity_names.get(code, code)
+            values = list(item[3:])
+            extra = values.pop() if values and isinstance(values[-1], dict) else {}
+            properties = {}
+            if NAME_PROPERTY in self.entity_types.get(type_name, [NAME_PROPERTY]):
+                properties[NAME_PROPERTY] = name
+            for key, value in zip(self._positional_properties(type_name), values):
+                if value is not None:
+                    properties[key] = value
+            properties.update(extra)
+            nodes.append({"id": node_id, "name": name, "type": type_name, "properties": properties})
+        relationships = []
+        for item in data.get("r", []):
+            rel_type = self.relation_names.get(item[2], item[2])
+            name = item[3] if len(item) > 3 else rel_type
+            relationships.append({"name": name, "type": rel_type, "from": item[0], "to": item[1]})
+        return {"nodes": nodes, "relationships": relationships}
+
+    def compress(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """将 nodes/relationships 结构编码为紧凑格式，用于评估输出 token 的节省"""
+        nodes = []
+        for node in data.get("nodes", []):
+            properties = dict(node.get("properties") or {})
+            name = node.get("name") or properties.get(NAME_PROPERTY)
+            properties.pop(NAME_PROPERTY, None)
+            values = [properties.pop(key, None) for key in self._positional_properties(node["type"])]
+            while values and values[-1] is None:
+                values.pop()
+            item = [node["id"], name, self.entity_codes.get(node["type"], node["type"]), *values]
+            if properties:
+                item.append(properties)
+            nodes.append(item)
+        relationships = []
+        for rel in data.get("relationships", []):
+            item = [rel["from"], rel["to"], self.relation_codes.get(rel["type"], rel["type"])]
+            if rel.get("name", rel["type"]) != rel["type"]:
+                item.append(rel["name"])
+            relationships.append(item)
+        return {"n": nodes, "r": relationships}
+
+
+@lru_cache(maxsize=32)
+def get_compact_schema(prompt: str) -> CompactSchema:
+    """同一提示词的编码表只解析一次"""
+    return CompactSchema.from_prompt(prompt)
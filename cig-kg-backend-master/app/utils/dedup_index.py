@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+# MinHash 使用的 Mersenne 素数与哈希函数个数
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+_PRIME = np.uint64(MERSENNE_PRIME)
+_LOW32 = np.uint64(MAX_HASH)
+_LOW29 = np.uint64((1 << 29) - 1)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def shingles(text: str, size: int = 5) -> set:
+    """去除空白后按 size 个字符切分的字符片段集合，中文文本无需分词"""
+    text = WHITESPACE_PATTERN.sub("", text)
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _mod_prime(x: np.ndarray) -> np.ndarray:
+    """x mod (2^61-1)，x 为 uint64，利用 2^61 ≡ 1 折叠高位"""
+    x = (x & _PRIME) + (x >> np.uint64(61))
+    return np.where(x >= _PRIME, x - _PRIME, x)
+
+
+class MinHasher:
+    """用 num_perm 个 (a*x+b) mod p 的随机置换计算 MinHash 签名，参数由固定种子生成，跨进程一致
+
+    按置换 × 片段的矩阵用 numpy 计算，a*x 拆为高低两段保证 uint64 不溢出，结果与逐个整数计算一致。
+    """
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        self.num_perm = num_perm
+        self.permutations = []
+        for i in range(num_perm):
+            digest = hashlib.sha256(f"{seed}-{i}".encode()).digest()
+            a, b = struct.unpack("<QQ", digest[:16])
+            self.permutations.append((a % (MERSENNE_PRIME - 1) + 1, b % MERSENNE_PRIME))
+        a = np.array([a for a, _ in self.permutations], dtype=np.uint64)[:, None]
+        self._a_high = a >> np.uint64(32)  # < 2^29
+        self._a_low = a & _LOW32  # < 2^32
+        self._b = np.array([b for _, b in self.permutations], dtype=np.uint64)[:, None]
+
+    def signature(self, items: set) -> List[int]:
+        hashes = np.array([struct.unpack("<I", hashlib.blake2b(item.encode("utf-8"), digest_size=4).digest())[0]
+                           for item in items], dtype=np.uint64)[None, :]
+        # a*h = a_high*h*2^32 + a_low*h；y*2^32 mod p = (y >> 29) + ((y & (2^29-1)) << 32)
+        high = _mod_prime(self._a_high * hashes)
+        high = (high >> np.uint64(29)) + ((high & _LOW29) << np.uint64(32))
+        values = _mod_prime(_mod_prime(high) + _mod_prime(self._a_low * hashes))
+        values = _mod_prime(values + self._b)
+        return (values & _LOW32).min(axis=1).tolist()
+
+
+def estimate_jaccard(sig1: List[int], sig2: List[int]) -> float:
+    return sum(1 for x, y in zip(sig1, sig2) if x == y) / len(sig1)
+
+
+class NearDuplicateIndex:
+    """跨文档持久化的近重复分块索引（MinHash + LSH）
+
+    签名分为 bands 段，每段 rows 个值，任一段完全相同即为候选，再按签名估计的 Jaccard 相似度
+    不低于 threshold 确认近重复。scope 为模型与提示词的指纹，只在相同抽取配置之间复用结果。
+    条目数超出 max_entries 时按最近命中时间淘汰。
+    """
+
+    def __init__(self, db_path: str = "cache/dedup_index.sqlite3", threshold: float = 0.9,
+                 bands: int = 16, rows: int = 8, min_chars: int = 100, max_entries: int = 20000):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.min_chars = min_chars
+        self.max_entries = max_entries
+        self.hasher = MinHasher(num_perm=bands * rows)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scope TEXT NOT NULL,
+                signature TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL DEFAULT 0
+            )
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(chunks)")]
+        if "last_access" not in columns:
+            # 旧版索引没有访问时间列，补列后按创建时间初始化
+            self._conn.execute("ALTER TABLE chunks ADD COLUMN last_access REAL NOT NULL DEFAULT 0")
+            self._conn.execute("UPDATE chunks SET last_access = created_at")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS bands (
+                bucket TEXT NOT NULL,
+                chunk_id INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_bands_bucket ON bands(bucket)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_bands_chunk ON bands(chunk_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_access ON chunks(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_scope(model_name: str, system_prompt: str, prompt: str) -> str:
+        digest = hashlib.sha256()
+        for part in (model_name, system_prompt, prompt):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def signature(self, text: str) -> Optional[List[int]]:
+        """过短的分块不参与近重复判断，返回 None"""
+        if len(WHITESPACE_PATTERN.sub("", text)) < self.min_chars:
+            return None
+        return self.hasher.signature(shingles(text))
+
+    def _buckets(self, scope: str, signature: List[int]) -> List[str]:
+        buckets = []
+        for band in range(self.bands):
+            values = signature[band * self.rows:(band + 1) * self.rows]
+            digest = hashlib.sha1(f"{scope}:{band}:{values}".encode()).hexdigest()
+            buckets.append(digest)
+        return buckets
+
+    def query(self, scope: str, signature: List[int]) -> Optional[Tuple[float, Dict[str, Any]]]:
+        """返回最相似的近重复分块的相似度与抽取结果，没有时返回 None，命中时刷新访问时间"""
+        buckets = self._buckets(scope, signature)
+        placeholders = ",".join("?" * len(buckets))
+        with self._lock:
+            rows = self._conn.execute(f"""
+                SELECT DISTINCT c.id, c.signature, c.result FROM bands b JOIN chunks c ON c.id = b.chunk_id
+                WHERE b.bucket IN ({placeholders}) AND c.scope = ?
+            """, (*buckets, scope)).fetchall()
+            best = None
+            for chunk_id, candidate_signature, result in rows:
+                similarity = estimate_jaccard(signature, json.loads(candidate_signature))
+                if similarity >= self.threshold and (best is None or similarity > best[0]):
+                    best = (similarity, chunk_id, result)
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE chunks SET last_access = ? WHERE id = ?", (time.time(), best[1]))
+            self._conn.commit()
+        return best[0], json.loads(best[2])
+
+    def add(self, scope: str, signature: List[int], result: Dict[str, Any]):
+        """记录已抽取分块的签名与抽取结果，并在条目数超出上限时淘汰最久未命中的条目"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO chunks (scope, signature, result, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (scope, json.dumps(signature), json.dumps(result, ensure_ascii=False), now, now)
+            )
+            self._conn.executemany(
+                "INSERT INTO bands (bucket, chunk_id) VALUES (?, ?)",
+                [(bucket, cursor.lastrowid) for bucket in self._buckets(scope, signature)]
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        if total <= self.max_entries:
+            return
+        ids = [(row[0],) for row in self._conn.execute(
+            "SELECT id FROM chunks ORDER BY last_access LIMIT ?", (total - self.max_entries,)
+        )]
+        self._conn.executemany("DELETE FROM bands WHERE chunk_id = ?", ids)
+        self._conn.executemany("DELETE FROM chunks WHERE id = ?", ids)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries,
+                "max_entries": self.max_entries, "threshold": self.threshold}
+
+
+_dedup_index = None
+_dedup_index_lock = threading.Lock()
+
+
+def get_dedup_index() -> Optional[NearDuplicateIndex]:
+    """获取进程内共享的近重复索引，DEDUP_ENABLED=false 时返回 None"""
+    global _dedup_index
+    with _dedup_index_lock:
+        load_dotenv()
+        if os.getenv("DEDUP_ENABLED", "true").lower() != "true":
+            return None
+        if _dedup_index is None:
+            _dedup_index = NearDuplicateIndex(
+                db_path=os.getenv("DEDUP_INDEX_PATH", "cache/dedup_index.sqlite3"),
+                threshold=float(os.getenv("DEDUP_THRESHOLD", "0.9")),
+                max_entries=int(os.getenv("DEDUP_MAX_ENTRIES", "20000")),
+            )
+    return _dedup_index
@@ -30,6 +30,20 @@ def replace_ids_with_random(data):
     return data
 
 
+# 合并多次抽取的结果，为各部分的局部ID加上前缀避免冲突
+def merge_kg_data(parts):
+    merged = {"nodes": [], "relationships": []}
+    for index, part in enumerate(parts):
+        for node in part.get('nodes', []):
+            node['id'] = f"{index}-{node['id']}"
+            merged['nodes'].append(node)
+        for relation in part.get('relationships', []):
+            relation['from'] = f"{index}-{relation['from']}"
+            relation['to'] = f"{index}-{relation['to']}"
+            merged['relationships'].append(relation)
+    return merged
+
+
 # 保存 JSON 文件
 def save_json(data, file_path):
     with open(file_path, 'w', encoding='utf-8') as file:
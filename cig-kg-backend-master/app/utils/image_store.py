@@ -0,0 +1,80 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import pymupdf
+
+# 图片统一保存在项目根目录的 images/ 下，markdown 中以 images/<文件名> 引用（与 img_service 一致）
+IMAGE_DIR = "images"
+IMAGE_REF_PATTERN = re.compile(r"!\[[^\]]*\]\((images/[^)\s]+)\)")
+
+
+def store_image(src_path: str, image_dir: str = IMAGE_DIR) -> Tuple[str, Dict[str, Any]]:
+    """按内容哈希保存图片，相同内容的图片只保存一份
+
+    返回 (文件名, 图片信息)，文件名为内容 sha256 的前 32 位加原扩展名，src_path 在保存后删除。
+    """
+    with open(src_path, "rb") as f:
+        data = f.read()
+    ext = os.path.splitext(src_path)[1].lower()
+    name = f"{hashlib.sha256(data).hexdigest()[:32]}{ext}"
+    dest = os.path.join(image_dir, name)
+    if os.path.exists(dest):
+        os.remove(src_path)
+    else:
+        os.makedirs(image_dir, exist_ok=True)
+        shutil.move(src_path, dest)
+    pixmap = pymupdf.Pixmap(data)
+    return name, {"bytes": len(data), "width": pixmap.width, "height": pixmap.height, "format": ext.lstrip(".")}
+
+
+class ImageManifest:
+    """images/ 下按内容哈希保存的图片清单：大小、宽高与引用该图片的文档页，后续阶段无需打开图片文件"""
+
+    def __init__(self, path: str = os.path.join(IMAGE_DIR, "manifest.json")):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._load().get(name)
+
+    def update(self, infos: Dict[str, Dict[str, Any]], sources: Iterable[Tuple[str, str, int]]):
+        """记录新保存图片的信息与 (文件名, 文档名, 页码) 引用来源，写入临时文件后原子替换"""
+        with self._lock:
+            manifest = self._load()
+            for name, info in infos.items():
+                manifest.setdefault(name, {"sources": []}).update(info)
+            for name, document, page in sources:
+                entry = manifest.setdefault(name, {"sources": []})
+                source = {"document": document, "page": page}
+                if source not in entry["sources"]:
+                    entry["sources"].append(source)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+_image_manifest = None
+_image_manifest_lock = threading.Lock()
+
+
+def get_image_manifest() -> ImageManifest:
+    """获取进程内共享的图片清单"""
+    global _image_manifest
+    with _image_manifest_lock:
+        if _image_manifest is None:
+            _image_manifest = ImageManifest()
+    return _image_manifest
@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import openai
+
+from app.utils.llm_client import get_llm_client
+
+
+def is_backend_failure(e: Exception) -> bool:
+    """端点本身的故障：5xx、超时与连接错误；429 等限流由调度器处理，不计入摘除"""
+    if isinstance(e, (openai.APIConnectionError, openai.APITimeoutError)):  # 超时是连接错误的子类
+        return True
+    status_code = getattr(e, "status_code", None)
+    return status_code is not None and status_code >= 500
+
+
+class LLMBackend:
+    """一个模型服务端点及其运行状态"""
+
+    def __init__(self, base_url: str, api_key: str, model: str, weight: float = 1.0, name: Optional[str] = None):
+        self.name = name or base_url
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        self.weight = max(weight, 0.01)
+        self.client = get_llm_client(api_key=api_key, base_url=base_url)
+
+        self.outstanding = 0  # 在途请求数
+        self.ewma_latency = None  # 成功请求耗时的指数滑动平均（秒）
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "name": self.name,
+            "model": self.model,
+            "weight": self.weight,
+            "healthy": self.is_healthy(now),
+            "ejected_seconds_left": round(max(0.0, self.ejected_until - now), 1),
+            "outstanding": self.outstanding,
+            "ewma_latency": round(self.ewma_latency, 2) if self.ewma_latency is not None else None,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+        }
+
+
+class LLMBackendPool:
+    """按权重与在途请求数做最少连接负载均衡
+
+    连续 max_failures 次端点故障（5xx、超时、连接错误，见 is_backend_failure）、平均耗时超过其他端点中位数 slow_factor 倍或健康检查失败的端点会被暂时摘除，
+    摘除时长随次数指数增长，到期后自动恢复。
+    """
+
+    def __init__(self, backends: List[LLMBackend], max_failures: int = 3, eject_seconds: float = 30.0,
+                 slow_factor: float = 3.0, health_check_interval: float = 15.0):
+        if not backends:
+            raise ValueError("至少需要配置一个模型服务端点")
+        self.backends = backends
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.slow_factor = slow_factor
+        self.health_check_interval = health_check_interval
+        self._lock = threading.Lock()
+        if len(backends) > 1 and health_check_interval > 0:
+            threading.Thread(target=self._health_check_loop, name="llm-health-check", daemon=True).start()
+
+    def acquire(self, exclude: Optional[LLMBackend] = None) -> LLMBackend:
+        """选择 (在途请求数+1)/权重 最小的健康端点；全部被摘除时选最早恢复的端点"""
+        with self._lock:
+            now = time.time()
+            candidates = [b for b in self.backends if b is not exclude] or self.backends
+            healthy = [b for b in candidates if b.is_healthy(now)]
+            if healthy:
+                backend = min(healthy, key=lambda b: ((b.outstanding + 1) / b.weight, b.ewma_latency or 0.0))
+            else:
+                backend = min(candidates, key=lambda b: b.ejected_until)
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def release(self, backend: LLMBackend, latency: float, success: bool, error: Optional[Exception] = None):
+        """请求结束后更新端点状态，失败时传入异常，只有端点故障计入连续失败"""
+        with self._lock:
+            backend.outstanding -= 1
+            if not success:
+                if error is not None and not is_backend_failure(error):
+                    return
+                backend.failures += 1
+                backend.consecutive_failures += 1
+                if backend.consecutive_failures >= self.max_failures:
+                    self._eject(backend, "连续失败")
+                return
+            backend.consecutive_failures = 0
+            backend.ewma_latency = latency if backend.ewma_latency is None \
+                else 0.8 * backend.ewma_latency + 0.2 * latency
+            if self._is_slow(backend):
+                self._eject(backend, f"响应过慢({backend.ewma_latency:.1f}s)")
+
+    def status(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [backend.to_dict() for backend in self.backends]
+
+    def _is_slow(self, backend: LLMBackend) -> bool:
+        others = sorted(b.ewma_latency for b in self.backends
+                        if b is not backend and b.ewma_latency is not None and b.is_healthy(time.time()))
+        if not others:
+            return False
+        median = others[len(others) // 2]
+        return backend.ewma_latency > self.slow_factor * median
+
+    def _eject(self, backend: LLMBackend, reason: str):
+        # 不摘除最后一个健康端点
+        now = time.time()
+        if not any(b.is_healthy(now) for b in self.backends if b is not backend):
+            return
+        backend.ejections += 1
+        duration = min(self.eject_seconds * 2 ** (backend.ejections - 1), 600.0)
+        backend.ejected_until = now + duration
+        backend.consecutive_failures = 0
+        backend.ewma_latency = None  # 恢复后重新统计耗时
+        print(f"模型端点 {backend.name} 因{reason}被摘除 {duration:.0f} 秒")
+
+    def _health_check_loop(self):
+        while True:
+            time.sleep(self.health_check_interval)
+            for backend in self.backends:
+                try:
+                    backend.client.with_options(timeout=5.0).models.list()
+                    ok = True
+                except Exception:
+                    ok = False
+                with self._lock:
+                    if not ok and backend.is_healthy(time.time()):
+                        self._eject(backend, "健康检查失败")
+
+
+def load_backends() -> List[LLMBackend]:
+    """从 LLM_BACKENDS 读取端点列表，未配置时使用 API_KEY/BASE_URL/MODEL_NAME 单端点
+
+    LLM_BACKENDS 为 JSON 数组，例如
+    [{"base_url": "http://10.0.0.1:8000/v1", "api_key": "EMPTY", "model": "Qwen2.5-7B-Instruct", "weight": 2}]
+    """
+    default_model = os.getenv("MODEL_NAME", "MODEL_NAME")
+    config = os.getenv("LLM_BACKENDS", "").strip()
+    if not config:
+        return [LLMBackend(base_url=os.getenv("BASE_URL", "BASE_URL"),
+                           api_key=os.getenv("API_KEY", "API_KEY"),
+                           model=default_model)]
+    return [
+        LLMBackend(base_url=item["base_url"],
+                   api_key=item.get("api_key", "EMPTY"),
+                   model=item.get("model", default_model),
+                   weight=float(item.get("weight", 1.0)),
+                   name=item.get("name"))
+        for item in json.loads(config)
+    ]
+
+
+_backend_pool = None
+_backend_pool_lock = threading.Lock()
+
+
+def get_backend_pool() -> LLMBackendPool:
+    """获取进程内共享的端点池"""
+    global _backend_pool
+    with _backend_pool_lock:
+        if _backend_pool is None:
+            _backend_pool = LLMBackendPool(
+                load_backends(),
+                max_failures=int(os.getenv("LLM_MAX_FAILURES", "3")),
+                eject_seconds=float(os.getenv("LLM_EJECT_SECONDS", "30")),
+                slow_factor=float(os.getenv("LLM_SLOW_FACTOR", "3")),
+                health_check_interval=float(os.getenv("LLM_HEALTH_CHECK_SECONDS", "15")),
+            )
+    return _backend_pool
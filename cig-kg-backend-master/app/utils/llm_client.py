@@ -0,0 +1,66 @@
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from openai import OpenAI
+
+# 进程启动时加载一次 .env，之后各请求复用同一组客户端
+load_dotenv()
+
+try:
+    import h2  # noqa: F401  安装 httpx[http2] 后启用 HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_clients: Dict[Tuple[str, str], OpenAI] = {}
+_clients_lock = threading.Lock()
+
+
+def _pool_limits() -> httpx.Limits:
+    """连接池大小由 LLM_POOL_SIZE 配置，空闲连接保持 LLM_KEEPALIVE_SECONDS 秒"""
+    pool_size = int(os.getenv("LLM_POOL_SIZE", "32"))
+    return httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_SECONDS", "60")),
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(float(os.getenv("LLM_TIMEOUT_SECONDS", "600")), connect=10.0)
+
+
+def _resolve(api_key: Optional[str], base_url: Optional[str]) -> Tuple[str, str]:
+    return (api_key or os.getenv("API_KEY", "API_KEY"),
+            base_url or os.getenv("BASE_URL", "BASE_URL"))
+
+
+def get_llm_client(api_key: Optional[str] = None, base_url: Optional[str] = None) -> OpenAI:
+    """获取共享的同步客户端，同一 (api_key, base_url) 复用同一个 keep-alive 连接池
+
+    客户端线程安全，构建流水线的各抽取线程共用；重试交由 LLMScheduler 处理。
+    """
+    key = _resolve(api_key, base_url)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = OpenAI(
+                api_key=key[0],
+                base_url=key[1],
+                max_retries=0,
+                http_client=httpx.Client(limits=_pool_limits(), timeout=_timeout(), http2=HTTP2_AVAILABLE),
+            )
+            _clients[key] = client
+    return client
+
+
+def close_llm_clients():
+    """应用关闭时释放连接池"""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
@@ -0,0 +1,238 @@
+import os
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import openai
+from dotenv import load_dotenv
+
+# 可重试的服务端错误状态码
+RETRYABLE_STATUS_CODES = (408, 409, 500, 502, 503, 504)
+CJK_PATTERN = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的 token 数：中文字符约 1 token/字，其余约 4 字符/token"""
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+class TokenBucket:
+    """令牌桶，rate 为每秒补充量，capacity 为桶容量"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1) -> float:
+        """阻塞直到取得 amount 个令牌，返回等待的秒数"""
+        amount = min(amount, self.capacity)  # 单次请求超过桶容量时按桶容量放行
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def try_acquire(self, amount: float = 1) -> bool:
+        """不等待地取 amount 个令牌，不足时返回 False"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens < amount:
+                return False
+            self.tokens -= amount
+            return True
+
+    def refund(self, amount: float = 1):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+
+class LLMScheduler:
+    """所有大模型请求的统一调度器
+
+    - 请求数（RPM）与预估 token 数（TPM）各用一个令牌桶限流；
+    - 429 时优先按 Retry-After 等待，否则按带抖动的指数退避重试；
+    - 并发上限按 AIMD 自适应：被限流时减半，连续成功一轮后加一。
+    """
+
+    def __init__(self, rpm: int = 0, tpm: int = 0, max_concurrency: int = 8, min_concurrency: int = 1,
+                 max_retries: int = 6, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.request_bucket = TokenBucket(rpm / 60.0, rpm) if rpm > 0 else None
+        self.token_bucket = TokenBucket(tpm / 60.0, tpm) if tpm > 0 else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency_limit = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._queue_depth = 0
+        self._successes_since_change = 0
+        self._last_decrease = 0.0
+        self._metrics = {"requests": 0, "throttled": 0, "retries": 0, "failures": 0, "rate_limit_wait_seconds": 0.0}
+
+    def call(self, fn: Callable[[], Any], estimated_tokens: int = 0) -> Any:
+        """在限流与并发控制下执行 fn，遇到限流或临时错误时自动重试"""
+        attempt = 0
+        while True:
+            self._acquire_slot()
+            try:
+                waited = 0.0
+                if self.request_bucket is not None:
+                    waited += self.request_bucket.acquire(1)
+                if self.token_bucket is not None and estimated_tokens > 0:
+                    waited += self.token_bucket.acquire(estimated_tokens)
+                self._add_metric("requests")
+                self._add_metric("rate_limit_wait_seconds", waited)
+                result = fn()
+            except Exception as e:
+                throttled = self._is_throttle(e)
+                if throttled:
+                    self._add_metric("throttled")
+                    self._decrease_concurrency()
+                if not (throttled or self._is_retryable(e)) or attempt >= self.max_retries:
+                    self._add_metric("failures")
+                    raise
+                delay = self._retry_after(e) if throttled else None
+                if delay is None:
+                    # 全抖动指数退避
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                attempt += 1
+                self._add_metric("retries")
+                print(f"LLM请求失败({type(e).__name__})，{delay:.1f}秒后第{attempt}次重试")
+            else:
+                self._increase_concurrency()
+                return result
+            finally:
+                self._release_slot()
+            time.sleep(delay)
+
+    def try_reserve(self, estimated_tokens: int = 0) -> bool:
+        """不等待地占用一个并发名额并扣除 RPM/TPM 令牌，供对冲等可放弃的附加请求使用
+
+        配额不足时返回 False 且不占用任何配额；返回 True 后须在请求结束时调用 release_reserved。
+        """
+        with self._cond:
+            if self._in_flight >= self.concurrency_limit:
+                return False
+            self._in_flight += 1
+        if self.request_bucket is not None and not self.request_bucket.try_acquire(1):
+            self._release_slot()
+            return False
+        if self.token_bucket is not None and estimated_tokens > 0 \
+                and not self.token_bucket.try_acquire(estimated_tokens):
+            if self.request_bucket is not None:
+                self.request_bucket.refund(1)
+            self._release_slot()
+            return False
+        self._add_metric("requests")
+        return True
+
+    def release_reserved(self):
+        self._release_slot()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                **self._metrics,
+                "rate_limit_wait_seconds": round(self._metrics["rate_limit_wait_seconds"], 2),
+                "queue_depth": self._queue_depth,
+                "in_flight": self._in_flight,
+                "concurrency_limit": self.concurrency_limit,
+            }
+
+    def _acquire_slot(self):
+        with self._cond:
+            self._queue_depth += 1
+            while self._in_flight >= self.concurrency_limit:
+                self._cond.wait()
+            self._queue_depth -= 1
+            self._in_flight += 1
+
+    def _release_slot(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _add_metric(self, key: str, value: float = 1):
+        with self._cond:
+            self._metrics[key] += value
+
+    def _increase_concurrency(self):
+        with self._cond:
+            self._successes_since_change += 1
+            if self._successes_since_change >= self.concurrency_limit and self.concurrency_limit < self.max_concurrency:
+                self.concurrency_limit += 1
+                self._successes_since_change = 0
+                self._cond.notify_all()
+
+    def _decrease_concurrency(self):
+        with self._cond:
+            # 同一波限流只减半一次
+            now = time.monotonic()
+            if now - self._last_decrease < 1.0:
+                return
+            self._last_decrease = now
+            self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit // 2)
+            self._successes_since_change = 0
+
+    @staticmethod
+    def _is_throttle(e: Exception) -> bool:
+        return isinstance(e, openai.RateLimitError) or getattr(e, "status_code", None) == 429
+
+    @staticmethod
+    def _is_retryable(e: Exception) -> bool:
+        if isinstance(e, (openai.APIConnectionError, openai.APITimeoutError)):
+            return True
+        return getattr(e, "status_code", None) in RETRYABLE_STATUS_CODES
+
+    def _retry_after(self, e: Exception) -> Optional[float]:
+        """读取响应头中的 Retry-After（秒）或 retry-after-ms"""
+        response = getattr(e, "response", None)
+        headers = getattr(response, "headers", None)
+        if not headers:
+            return None
+        try:
+            if headers.get("retry-after-ms"):
+                return min(self.max_delay, float(headers["retry-after-ms"]) / 1000)
+            if headers.get("retry-after"):
+                return min(self.max_delay, float(headers["retry-after"]))
+        except ValueError:
+            return None
+        return None
+
+
+_llm_scheduler = None
+_llm_scheduler_lock = threading.Lock()
+
+
+def get_llm_scheduler() -> LLMScheduler:
+    """获取进程内共享的调度器，所有构建任务共用同一组限流配额"""
+    global _llm_scheduler
+    with _llm_scheduler_lock:
+        if _llm_scheduler is None:
+            load_dotenv()
+            _llm_scheduler = LLMScheduler(
+                rpm=int(os.getenv("LLM_RPM", "0")),
+                tpm=int(os.getenv("LLM_TPM", "0")),
+                max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+                max_retries=int(os.getenv("LLM_MAX_RETRIES", "6")),
+            )
+    return _llm_scheduler
@@ -3,6 +3,33 @@ import os
 from dotenv import load_dotenv
 from neo4j import GraphDatabase
 from tqdm import tqdm
+from app.utils.build_manifest import chunk_source, list_chunk_files
+
+# 节点上按来源分块记录的属性（JSON），删除某个分块的导入时据此重建合并节点的属性
+SOURCE_PROPERTIES = "source_properties"
+
+
+def rebuild_without_source(node_id, name, sources, source_properties, source):
+    """去掉一个来源分块后按剩余来源重建节点属性：各来源的属性按分块顺序覆盖，页码取并集
+
+    剩余来源中有缺少属性记录的（旧版本导入的数据）时无法重建，只更新 sources，返回 None。
+    """
+    rest = [s for s in sources if s != source]
+    by_source = json.loads(source_properties or "{}")
+    by_source.pop(source, None)
+    if any(s not in by_source for s in rest):
+        return None
+    properties = {}
+    pages = set()
+    for s in sorted(by_source):
+        properties.update(by_source[s])
+        pages.update(by_source[s].get("pages") or [])
+    properties.pop("pages", None)
+    if pages:
+        properties["pages"] = sorted(pages)
+    properties.update({"id": node_id, "name": name, "sources": rest,
+                       SOURCE_PROPERTIES: json.dumps(by_source, ensure_ascii=False)})
+    return properties
 
 
 class Neo4jImporter:
@@ -16,29 +43,69 @@ class Neo4jImporter:
     def close(self):
         self.driver.close()
 
-    def _create_node(self, tx, node_id, node_name, node_type, properties):
-        """创建初始节点（不合并）"""
+    def _create_node(self, tx, node_id, node_name, node_type, properties, source):
+        """创建初始节点（不合并），sources 记录节点来自哪些分块"""
         # 检查 properties 中是否存在键 "实体名"
         if "实体名" in properties:
             # 将 "实体名" 的值赋值给 "name"
             properties["name"] = properties.pop("实体名")
         if "图片路径" in properties:
             properties["path"] = properties.pop("图片路径")
+        if "来源页码" in properties:
+            # 页码列表，按页溯源时直接查询 n.pages
+            properties["pages"] = properties.pop("来源页码")
 
         tx.run(f"""
             CREATE (n:`{node_type}`)
             SET n.id = $node_id,
                 n.name = $node_name,
-                n += $properties
-        """, node_id=node_id, node_name=node_name, properties=properties)
+                n += $properties,
+                n.sources = [$source],
+                n.{SOURCE_PROPERTIES} = $source_properties
+        """, node_id=node_id, node_name=node_name, properties=properties, source=source,
+               source_properties=json.dumps({source: properties}, ensure_ascii=False))
 
-    def _create_relationship(self, tx, name, from_id, to_id, rel_type):
+    def _create_relationship(self, tx, name, from_id, to_id, rel_type, source):
         """创建关系（基于节点ID）"""
         tx.run(f"""
             MATCH (a), (b)
             WHERE a.id = $from_id AND b.id = $to_id
             MERGE (a)-[r:`{name}`]->(b)
-        """, from_id=from_id, to_id=to_id)
+            SET r.sources = CASE WHEN $source IN coalesce(r.sources, []) THEN r.sources
+                                 ELSE coalesce(r.sources, []) + $source END
+        """, from_id=from_id, to_id=to_id, source=source)
+
+    def _delete_source(self, tx, source):
+        """删除只来自该分块的节点与关系，与其他分块合并后的节点按剩余来源重建属性"""
+        tx.run("""
+            MATCH ()-[r]->()
+            WHERE $source IN r.sources
+            WITH r, [s IN r.sources WHERE s <> $source] AS rest
+            FOREACH (_ IN CASE WHEN size(rest) = 0 THEN [1] ELSE [] END | DELETE r)
+            FOREACH (_ IN CASE WHEN size(rest) > 0 THEN [1] ELSE [] END | SET r.sources = rest)
+        """, source=source)
+        tx.run("""
+            MATCH (n)
+            WHERE n.sources = [$source]
+            DETACH DELETE n
+        """, source=source)
+        shared = tx.run(f"""
+            MATCH (n)
+            WHERE $source IN n.sources
+            RETURN n.id AS id, n.name AS name, n.sources AS sources, n.{SOURCE_PROPERTIES} AS source_properties
+        """, source=source).data()
+        for node in shared:
+            properties = rebuild_without_source(node["id"], node["name"], node["sources"],
+                                                node["source_properties"], source)
+            if properties is None:
+                properties_update = "SET n.sources = [s IN n.sources WHERE s <> $source]"
+            else:
+                properties_update = "SET n = $properties"
+            tx.run(f"""
+                MATCH (n)
+                WHERE n.id = $node_id AND $source IN n.sources
+                {properties_update}
+            """, node_id=node["id"], source=source, properties=properties)
 
     def _merge_duplicate_nodes(self, tx):
         """合并相同实体名的节点，取属性的并集"""
@@ -49,16 +116,23 @@ class Neo4jImporter:
             SET n:MergeCandidate
         """)
 
-        # 2. 合并相同名称的节点，取属性的并集
-        tx.run("""
+        # 2. 合并相同名称的节点，取属性的并集，来源页码、来源分块与各来源的属性记录取各节点的并集
+        tx.run(f"""
             MATCH (n:MergeCandidate)
             WITH n.name AS name, COLLECT(n) AS nodes
             WHERE size(nodes) > 1
-            CALL apoc.refactor.mergeNodes(nodes, {
+            WITH nodes, apoc.coll.sort(apoc.coll.toSet(apoc.coll.flatten([x IN nodes | coalesce(x.pages, [])]))) AS pages,
+                 apoc.coll.toSet(apoc.coll.flatten([x IN nodes | coalesce(x.sources, [])])) AS sources,
+                 apoc.map.mergeList([x IN nodes | apoc.convert.fromJsonMap(coalesce(x.{SOURCE_PROPERTIES}, "{{}}"))])
+                     AS source_properties
+            CALL apoc.refactor.mergeNodes(nodes, {{
                 properties: "overwrite",  
                 mergeRels: true,          
                 mergeRels: true           
-            }) YIELD node
+            }}) YIELD node
+            FOREACH (_ IN CASE WHEN size(pages) > 0 THEN [1] ELSE [] END | SET node.pages = pages)
+            FOREACH (_ IN CASE WHEN size(sources) > 0 THEN [1] ELSE [] END | SET node.sources = sources)
+            SET node.{SOURCE_PROPERTIES} = apoc.convert.toJson(source_properties)
             RETURN count(node)
         """)
 
@@ -71,30 +145,40 @@ class Neo4jImporter:
     def import_from_json(self, json_path):
         with open(json_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
+        self.import_data(data, chunk_source(os.path.dirname(json_path), os.path.basename(json_path)))
+
+    def delete_source(self, source_name):
+        """删除此前从该分块导入的数据，分块重新抽取后先删除再导入"""
+        with self.driver.session(database=self.database) as session:
+            session.execute_write(self._delete_source, source_name)
 
+    def import_data(self, data, source_name):
+        """导入单个分块的节点与关系，source_name（见 chunk_source）记录在节点与关系的 sources 上"""
         with self.driver.session(database=self.database) as session:
             # 第一阶段：创建所有节点（不合并）
-            for node in tqdm(data["nodes"], desc=f"Creating nodes from {os.path.basename(json_path)}"):
+            for node in tqdm(data["nodes"], desc=f"Creating nodes from {source_name}"):
                 try:
                     session.execute_write(
                         self._create_node,
                         node["id"],
                         node["name"],
                         node["type"],
-                        node["properties"]
+                        node["properties"],
+                        source_name
                     )
                 except Exception as e:
                     print(f"创建节点出现异常: {e}")
 
             # 第二阶段：创建关系
-            for rel in tqdm(data["relationships"], desc=f"Creating relationships from {os.path.basename(json_path)}"):
+            for rel in tqdm(data["relationships"], desc=f"Creating relationships from {source_name}"):
                 try:
                     session.execute_write(
                         self._create_relationship,
                         rel["name"],
                         rel["from"],
                         rel["to"],
-                        rel["type"]
+                        rel["type"],
+                        source_name
                     )
                 except Exception as e:
                     print(f"创建边出现异常: {e}")
@@ -102,21 +186,32 @@ class Neo4jImporter:
             # 第三阶段：合并重复节点
             # session.execute_write(self._merge_duplicate_nodes)
 
-    def batch_import_to_neo4j(self, json_dir):
+    def merge_duplicate_nodes(self):
+        """合并数据库中同名的重复节点"""
+        with self.driver.session(database=self.database) as session:
+            try:
+                session.execute_write(self._merge_duplicate_nodes)
+            except Exception as e:
+                print(f"合并重复节点出现异常: {e}")
+
+    def batch_import_to_neo4j(self, json_dir, json_files=None, on_imported=None):
+        """导入目录下的分块结果
+
+        json_files 指定只导入的文件名，默认导入全部分块；on_imported(json_file) 在每个文件导入后回调。
+        """
 
-        # 遍历目录中的所有JSON文件
-        json_files = [f for f in os.listdir(json_dir) if f.endswith('.json')]
+        # 遍历目录中的所有分块JSON文件
+        if json_files is None:
+            json_files = list_chunk_files(json_dir)
 
         for json_file in tqdm(json_files, desc="Processing JSON files"):
             json_path = os.path.join(json_dir, json_file)
             self.import_from_json(json_path)
+            if on_imported is not None:
+                on_imported(json_file)
 
         # 第三阶段：合并重复节点
-        with self.driver.session(database=self.database) as session:
-            try:
-                session.execute_write(self._merge_duplicate_nodes)
-            except Exception as e:
-                print(f"合并重复节点出现异常: {e}")
+        self.merge_duplicate_nodes()
 
         self.close()
 
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import pymupdf
+from dotenv import load_dotenv
+
+
+def page_hashes(doc: pymupdf.Document) -> List[str]:
+    """按页计算内容哈希：页面尺寸与旋转、内容流以及引用的图片、字体与表单对象
+
+    同一文档中共享的资源只读取一次；修订版中未改动的页与原版哈希相同，可跨文档复用转换结果。
+    """
+    resource_digests: Dict[int, bytes] = {}
+
+    def resource_digest(xref: int) -> bytes:
+        if xref not in resource_digests:
+            data = doc.xref_stream_raw(xref) if doc.xref_is_stream(xref) else doc.xref_object(xref).encode()
+            resource_digests[xref] = hashlib.sha256(data or b"").digest()
+        return resource_digests[xref]
+
+    hashes = []
+    for page in doc:
+        digest = hashlib.sha256()
+        digest.update(f"{tuple(page.rect)}:{page.rotation}".encode())
+        digest.update(page.read_contents())
+        xrefs = [item[0] for item in page.get_images(full=True)]
+        xrefs += [item[0] for item in page.get_fonts(full=True)]
+        xrefs += [item[0] for item in page.get_xobjects()]
+        for xref in xrefs:
+            if xref > 0:
+                digest.update(resource_digest(xref))
+        hashes.append(digest.hexdigest())
+    return hashes
+
+
+class PageCache:
+    """基于 SQLite 的 PDF 逐页转换结果缓存
+
+    以页内容哈希与转换配置为键，值为该页的转换结果（版面分析结果或 markdown），
+    超出容量时按最近访问时间淘汰。
+    """
+
+    def __init__(self, db_path: str = "cache/pdf_page_cache.sqlite3", max_bytes: int = 1024 * 1024 * 1024):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS page_cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_page_cache_access ON page_cache(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(page_hash: str, config: str) -> str:
+        return hashlib.sha256(f"{config}\0{page_hash}".encode()).hexdigest()
+
+    def contains_many(self, keys: List[str]) -> set:
+        """返回已缓存的键，只查询键不读取值"""
+        found = set()
+        with self._lock:
+            for key in set(keys):
+                if self._conn.execute("SELECT 1 FROM page_cache WHERE key = ?", (key,)).fetchone() is not None:
+                    found.add(key)
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def get(self, key: str) -> Optional[bytes]:
+        """读取单页缓存，命中时刷新访问时间，不计入命中统计"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM page_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE page_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return row[0]
+
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        """批量读取缓存，返回命中的键与值，命中时刷新访问时间"""
+        found = {}
+        with self._lock:
+            for key in set(keys):
+                row = self._conn.execute("SELECT value FROM page_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    found[key] = row[0]
+            now = time.time()
+            self._conn.executemany("UPDATE page_cache SET last_access = ? WHERE key = ?",
+                                   [(now, key) for key in found])
+            self._conn.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items: Dict[str, bytes]):
+        """批量写入缓存，并在总大小超出上限时淘汰最久未访问的条目"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO page_cache (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                [(key, value, len(value), now) for key, value in items.items()]
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM page_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM page_cache ORDER BY last_access").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM page_cache WHERE key = ?", (key,))
+            total -= size
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM page_cache"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+_page_cache = None
+_page_cache_lock = threading.Lock()
+
+
+def get_page_cache() -> Optional[PageCache]:
+    """获取进程内共享的逐页缓存，PDF_PAGE_CACHE_ENABLED=false 时返回 None"""
+    global _page_cache
+    with _page_cache_lock:
+        load_dotenv()
+        if os.getenv("PDF_PAGE_CACHE_ENABLED", "true").lower() != "true":
+            return None
+        if _page_cache is None:
+            _page_cache = PageCache(
+                db_path=os.getenv("PDF_PAGE_CACHE_PATH", "cache/pdf_page_cache.sqlite3"),
+                max_bytes=int(os.getenv("PDF_PAGE_CACHE_MAX_MB", "1024")) * 1024 * 1024
+            )
+    return _page_cache
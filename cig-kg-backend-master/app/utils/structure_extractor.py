@@ -0,0 +1,269 @@
+import bisect
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.utils import id_assign
+from app.utils.compact_schema import NAME_PROPERTY
+from app.utils.table_extractor import DEVICE_CODE_PATTERN, REFERENCE_PATTERN, REFERENCE_TYPE
+from app.utils.text_split import MD_HEADING_PATTERN
+
+# 提示词中的类型与关系定义块：“- 类型名称：[X]”/“- 关系名称：[X]”开头，到下一个定义块或顶格的下一节为止
+DEFINITION_PATTERN = re.compile(r"^[ \t]*-[ \t]*(类型名称|关系名称)：\[([^\]\n]+)\]")
+ENDPOINT_PATTERN = re.compile(r"(起点类型|终点类型)：\[([^\]\n]+)\]")
+# 标题类型定义中的 "#" 标识，如 常伴有"####"标识
+HEADING_MARK_PATTERN = re.compile(r"[\"“](#{1,6})[\"”]")
+IMAGE_TYPE = "图片"
+IMAGE_PATH_PROPERTY = "图片路径"
+IMAGE_PATTERN = re.compile(r"!\[[^\]]*\]\(([^)\s]+)\)")
+# 图片下方的图注，如“图形 1.”
+CAPTION_PATTERN = re.compile(r"\s*(图形[ \t]*\d+[.．]?)")
+LIST_ITEM_PATTERN = re.compile(r"^[ \t]*(?:[-*+]|\d+[.)、])[ \t]+")
+# 设备名称中“代码 - 描述”的分隔
+NAME_SEPARATOR = " - "
+
+
+class Ontology:
+    """从提示词解析的本体：实体类型定义块、关系的起点与终点类型，以及可按规则识别的类型
+
+    定义中带 "#" 标识的标题类型、图片与参见由规则识别，其余为需要大模型抽取的语义类型。
+    """
+
+    def __init__(self, prompt: str):
+        self.prompt = prompt
+        self.entity_blocks: Dict[str, str] = {}
+        self.relations: List[Tuple[str, str, str]] = []  # (关系名, 起点类型, 终点类型)
+        self.spans: List[Tuple[str, str, int, int]] = []  # (类别, 名称, 起点, 终点)
+        self._parse()
+        # 标题类型按提示词中的定义顺序由高到低
+        self.heading_marks: Dict[int, str] = {}
+        self.heading_ranks: Dict[str, int] = {}
+        for name, block in self.entity_blocks.items():
+            mark = HEADING_MARK_PATTERN.search(block)
+            if mark is not None and len(mark.group(1)) not in self.heading_marks:
+                self.heading_marks[len(mark.group(1))] = name
+                self.heading_ranks[name] = len(self.heading_ranks)
+        self.rule_types = set(self.heading_ranks)
+        self.rule_types.update(name for name in (IMAGE_TYPE, REFERENCE_TYPE) if name in self.entity_blocks)
+
+    def _parse(self):
+        current = None  # [类别, 名称, 起点, 最后一个非空行的终点]
+        pos = 0
+        for line in self.prompt.splitlines(keepends=True):
+            start, pos = pos, pos + len(line)
+            match = DEFINITION_PATTERN.match(line)
+            ends_block = match is not None or (line.strip() and not line[0].isspace())
+            if current is not None and ends_block:
+                self.spans.append(tuple(current))
+                current = None
+            if match is not None:
+                current = [match.group(1), match.group(2).strip(), start, pos]
+            elif current is not None and line.strip():
+                current[3] = pos
+        if current is not None:
+            self.spans.append(tuple(current))
+        for kind, name, start, end in self.spans:
+            block = self.prompt[start:end]
+            if kind == "类型名称":
+                self.entity_blocks.setdefault(name, block)
+            else:
+                endpoints = dict(ENDPOINT_PATTERN.findall(block))
+                if "起点类型" in endpoints and "终点类型" in endpoints:
+                    self.relations.append((name, endpoints["起点类型"].strip(), endpoints["终点类型"].strip()))
+
+    def relation(self, from_type: str, to_type: str) -> Optional[str]:
+        for name, start, end in self.relations:
+            if start == from_type and end == to_type:
+                return name
+        return None
+
+    def semantic_prompt(self) -> str:
+        """去掉规则识别的类型及与其相关的关系定义，只让大模型抽取语义实体"""
+        if not self.rule_types:
+            return self.prompt
+        rule_relations = {name for name, start, end in self.relations
+                          if start in self.rule_types or end in self.rule_types}
+        pieces = []
+        pos = 0
+        for kind, name, start, end in self.spans:
+            if name in (self.rule_types if kind == "类型名称" else rule_relations):
+                pieces.append(self.prompt[pos:start])
+                pos = end
+        pieces.append(self.prompt[pos:])
+        types = "、".join(sorted(self.rule_types, key=lambda t: (self.heading_ranks.get(t, len(self.heading_ranks)), t)))
+        return "".join(pieces).rstrip() + f"\n- {types}已由程序按规则识别，不要输出这些类型的实体，也不要输出与它们相关的关系\n"
+
+
+@lru_cache(maxsize=32)
+def get_ontology(prompt: str) -> Ontology:
+    """同一提示词只解析一次"""
+    return Ontology(prompt)
+
+
+def semantic_prompt(prompt: str) -> str:
+    return get_ontology(prompt).semantic_prompt()
+
+
+HeadingStack = List[Tuple[str, str]]  # 由高到低的 (标题类型, 标题)
+
+
+def _push_heading(stack: HeadingStack, ontology: Ontology, heading_type: str, title: str) -> HeadingStack:
+    rank = ontology.heading_ranks[heading_type]
+    stack = [item for item in stack if ontology.heading_ranks[item[0]] < rank]
+    return stack + [(heading_type, title)]
+
+
+def _iter_headings(text: str, ontology: Ontology):
+    for match in MD_HEADING_PATTERN.finditer(text):
+        heading_type = ontology.heading_marks.get(len(match.group(1)))
+        if heading_type is not None:
+            yield match, heading_type, match.group(2).strip()
+
+
+def advance_headings(stack: Optional[HeadingStack], text: str, prompt: str) -> HeadingStack:
+    """返回读完 text 后仍未结束的标题路径，按顺序分块时作为下一个分块开头所属的标题"""
+    ontology = get_ontology(prompt)
+    stack = list(stack or [])
+    for _, heading_type, title in _iter_headings(text, ontology):
+        stack = _push_heading(stack, ontology, heading_type, title)
+    return stack
+
+
+def _mention_keys(node: Dict[str, Any]) -> List[str]:
+    """在原文中定位节点时依次尝试的字符串：缩写、名称开头的设备代码、完整名称、“ - ”之前的部分"""
+    properties = node.get("properties") or {}
+    name = str(properties.get(NAME_PROPERTY) or node.get("name") or "").strip()
+    keys = [str(properties["缩写"]).strip()] if properties.get("缩写") else []
+    code = DEVICE_CODE_PATTERN.match(name)
+    if code is not None:
+        keys.append(code.group(0))
+    keys.append(name)
+    if NAME_SEPARATOR in name:
+        keys.append(name.split(NAME_SEPARATOR)[0].strip())
+    return [key for key in dict.fromkeys(keys) if len(key) >= 2]
+
+
+def _find_mention(text: str, keys: List[str], start: int = 0, end: Optional[int] = None, last: bool = False) -> int:
+    end = len(text) if end is None else end
+    found = [text.rfind(key, start, end) if last else text.find(key, start, end) for key in keys]
+    found = [pos for pos in found if pos != -1]
+    if not found:
+        return -1
+    return max(found) if last else min(found)
+
+
+def link_structure(text: str, data: Dict[str, Any], prompt: str,
+                   heading_stack: Optional[HeadingStack] = None) -> Tuple[Dict[str, Any], int]:
+    """按规则识别分块中的标题、图片与参见，生成节点及结构关系，并与语义抽取结果关联
+
+    - 标题按提示词中各标题类型的 "#" 标识识别，heading_stack 为分块开头所属的上级标题，标题之间按本体连接；
+    - 图片取图片路径与下方的图注，连接到所在的标题，紧随图注的列表中提到的实体连接到该图片；
+    - 参见连接到同一行（其次同一段）中位于其前、最近提到的实体；
+    - 语义实体按在原文中首次出现的位置连接到所在的标题。
+    只生成本体中定义的类型与关系，返回 (合并后的结果, 规则生成的节点数)。
+    """
+    ontology = get_ontology(prompt)
+    if not ontology.rule_types:
+        return data, 0
+    # 节点以 (部分, ID) 标识：0 为传入的抽取结果，1 为规则生成的节点
+    nodes, relationships = [], []
+    rule_ids = {}
+    existing = {(n.get("type"), (n.get("properties") or {}).get(NAME_PROPERTY) or n.get("name")): (0, n["id"])
+                for n in data["nodes"]}
+    relation_keys = {(r.get("type"), (0, r.get("from")), (0, r.get("to"))) for r in data["relationships"]}
+
+    def node(type_name: str, name: str, **properties) -> Tuple[int, int]:
+        if (type_name, name) in existing:
+            return existing[(type_name, name)]
+        if (type_name, name) not in rule_ids:
+            rule_ids[(type_name, name)] = (1, len(nodes) + 1)
+            props = {NAME_PROPERTY: name}
+            props.update(properties)
+            nodes.append({"id": len(nodes) + 1, "name": name, "type": type_name, "properties": props})
+        return rule_ids[(type_name, name)]
+
+    def relate(from_type: str, from_ref: Tuple[int, Any], to_type: str, to_ref: Tuple[int, Any]):
+        name = ontology.relation(from_type, to_type)
+        if name is not None and (name, from_ref, to_ref) not in relation_keys:
+            relation_keys.add((name, from_ref, to_ref))
+            relationships.append((name, from_ref, to_ref))
+
+    def link_heading(stack: HeadingStack, to_type: str, to_ref: Tuple[int, Any]):
+        """连接到由内向外第一个与 to_type 定义了关系的上级标题"""
+        for heading_type, title in reversed(stack):
+            if ontology.relation(heading_type, to_type) is not None:
+                relate(heading_type, node(heading_type, title), to_type, to_ref)
+                return
+
+    # 标题：开头所属的上级标题与分块中的标题，记录每个标题之后的标题路径
+    stack = list(heading_stack or [])
+    for parent, child in zip(stack, stack[1:]):
+        relate(parent[0], node(*parent), child[0], node(*child))
+    offsets, stacks = [0], [stack]
+    for match, heading_type, title in _iter_headings(text, ontology):
+        stack = _push_heading(stack, ontology, heading_type, title)
+        heading_ref = node(heading_type, title)
+        if len(stack) > 1:
+            relate(stack[-2][0], node(*stack[-2]), heading_type, heading_ref)
+        offsets.append(match.start())
+        stacks.append(stack)
+
+    def stack_at(offset: int) -> HeadingStack:
+        return stacks[bisect.bisect_right(offsets, offset) - 1]
+
+    # 图片及其图注，图注之后紧接的列表为图例
+    legends = []  # (起点, 终点, 图片)
+    if IMAGE_TYPE in ontology.rule_types:
+        with_path = IMAGE_PATH_PROPERTY in ontology.entity_blocks[IMAGE_TYPE]
+        for match in IMAGE_PATTERN.finditer(text):
+            path = match.group(1)
+            caption = CAPTION_PATTERN.match(text, match.end())
+            name = f"({path}) {caption.group(1)}" if caption else f"({path})"
+            image_ref = node(IMAGE_TYPE, name, **({IMAGE_PATH_PROPERTY: path} if with_path else {}))
+            link_heading(stack_at(match.start()), IMAGE_TYPE, image_ref)
+            legend_start = legend_end = caption.end() if caption else match.end()
+            for line in text[legend_start:].splitlines(keepends=True):
+                if line.strip() and not LIST_ITEM_PATTERN.match(line):
+                    break
+                legend_end += len(line)
+            legends.append((legend_start, legend_end, image_ref))
+
+    # 语义实体：连接到所在的标题与所在图例的图片
+    has_headings = len(offsets) > 1
+    semantic_nodes = [n for n in data["nodes"] if n.get("type") not in ontology.rule_types]
+    mention_keys = {id(n): _mention_keys(n) for n in semantic_nodes}
+    for semantic in semantic_nodes:
+        keys = mention_keys[id(semantic)]
+        position = _find_mention(text, keys)
+        if position != -1 or not has_headings:
+            link_heading(stack_at(max(position, 0)), semantic["type"], (0, semantic["id"]))
+        if position == -1:
+            continue
+        for start, end, image_ref in legends:
+            if _find_mention(text, keys, start, end) != -1:
+                relate(semantic["type"], (0, semantic["id"]), IMAGE_TYPE, image_ref)
+
+    # 参见：连接到同一行（其次同一段）中位于其前、最近提到的实体
+    if REFERENCE_TYPE in ontology.rule_types:
+        sources = [n for n in semantic_nodes if ontology.relation(n["type"], REFERENCE_TYPE) is not None]
+        for match in REFERENCE_PATTERN.finditer(text):
+            reference_ref = node(REFERENCE_TYPE, re.sub(r"\s+", " ", match.group(0)))
+            line_start = text.rfind("\n", 0, match.start()) + 1
+            paragraph_start = text.rfind("\n\n", 0, match.start())
+            paragraph_start = 0 if paragraph_start == -1 else paragraph_start + 2
+            for scope_start in (line_start, paragraph_start):
+                found = [(_find_mention(text, mention_keys[id(n)], scope_start, match.start(), last=True), n)
+                         for n in sources]
+                found = [(pos, n) for pos, n in found if pos != -1]
+                if found:
+                    semantic = max(found, key=lambda item: item[0])[1]
+                    relate(semantic["type"], (0, semantic["id"]), REFERENCE_TYPE, reference_ref)
+                    break
+
+    if not nodes and not relationships:
+        return data, 0
+    merged = id_assign.merge_kg_data([data, {"nodes": nodes, "relationships": []}])
+    for name, (from_part, from_id), (to_part, to_id) in relationships:
+        merged["relationships"].append({"name": name, "type": name,
+                                        "from": f"{from_part}-{from_id}", "to": f"{to_part}-{to_id}"})
+    return merged, len(nodes)
@@ -0,0 +1,243 @@
+import html
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.utils.compact_schema import NAME_PROPERTY, get_compact_schema
+
+# 预处理结果中的表格：HTML 表格（X6 手册等）与 pdf2md 输出的 markdown 管道表格
+HTML_TABLE_PATTERN = re.compile(r"<table>.*?</table>", re.S)
+HTML_ROW_PATTERN = re.compile(r"<tr>(.*?)</tr>", re.S)
+HTML_CELL_PATTERN = re.compile(r"<t[dh][^>]*?(?:/>|>(.*?)</t[dh]>)", re.S)
+PIPE_TABLE_PATTERN = re.compile(r"(?:^[ \t]*\|.*\|[ \t]*(?:\n|$))+", re.M)
+PIPE_SEPARATOR_PATTERN = re.compile(r"^[\s|:\-]+$")
+# 缩写索引行：“2S699 PT机器内的护罩 2-83”，连续 INDEX_MIN_LINES 行以上视为一张表
+INDEX_LINE_PATTERN = re.compile(r"^[ \t]*(\S+)[ \t]+(\S.*?)[ \t]+(\d+ ?- ?\d+(?: ?(?:[,，÷]|\\div) ?\d+ ?- ?\d+)*)"
+                                r"(?: ?(?:[,，÷]|\\div))?[ \t]*\.?[ \t]*$")
+INDEX_MIN_LINES = 3
+# 设备代码，如 2S1673、2R126、2A596、S92
+DEVICE_CODE_PATTERN = re.compile(r"\d?[A-Z]{1,2}\d{2,5}[A-Z]?")
+# 参见引用，如“参见 CHECK_SECTION-参数: , 页 5-9”
+REFERENCE_PATTERN = re.compile(r"参见\s*[^,，;；()（）\n]*?[,，]?\s*页\s*\d+\s*-\s*\d+")
+# X6 手册的页眉页脚：同时含下列字样的页脚表格、只有“页 02-22”页码的页脚表格，
+# 与“X6 | 章节名 | 02”（左右页对调）的单行页眉表格
+PAGE_FOOTER_KEYWORDS = ("数据表格", "印刷板")
+PAGE_NUMBER_PATTERN = re.compile(r"页\s*\d+\s*-\s*\d+")
+PAGE_HEADER_MODEL = "X6"
+PAGE_HEADER_CHAPTER_PATTERN = re.compile(r"\d{2}")
+# 监视器子进程表格的标签行，其后的参数表格挂在该子进程下
+SUBPROCESS_LABEL = "子进程"
+LATEX_PATTERN = re.compile(r"\\\(|\\\)|\\mathrm|[{}]")
+
+DEVICE_TYPE = "设备"
+REFERENCE_TYPE = "参见"
+REFERENCE_RELATION = "有参见"
+
+
+def plain_text(text: str) -> str:
+    """去除单元格中的 HTML 标签、实体与 OCR 产生的行内公式标记，合并空白"""
+    text = html.unescape(re.sub(r"<br\s*/?>|<[^>]+>", " ", text)).replace("\\;", " ")
+    return re.sub(r"\s+", " ", LATEX_PATTERN.sub("", text)).strip()
+
+
+def parse_html_table(table: str) -> List[List[str]]:
+    return [[plain_text(cell or "") for cell in HTML_CELL_PATTERN.findall(row)]
+            for row in HTML_ROW_PATTERN.findall(table)]
+
+
+def parse_pipe_table(table: str) -> List[List[str]]:
+    rows = []
+    for line in table.strip().splitlines():
+        line = line.strip()
+        if PIPE_SEPARATOR_PATTERN.match(line):
+            continue
+        rows.append([plain_text(cell) for cell in line.strip("|").split("|")])
+    return rows
+
+
+class _GraphBuilder:
+    """按提示词中的本体生成节点与关系，同一分块内同类型同名的节点只生成一次"""
+
+    def __init__(self, prompt: str):
+        schema = get_compact_schema(prompt)
+        self.entity_types = schema.entity_types
+        self.relation_types = set(schema.relation_types)
+        self.nodes = []
+        self.relationships = []
+        self._ids = {}
+        self._relation_keys = set()
+
+    def has(self, *type_names: str) -> bool:
+        return all(name in self.entity_types or name in self.relation_types for name in type_names)
+
+    def node(self, type_name: str, name: str, **properties) -> int:
+        key = (type_name, name)
+        if key not in self._ids:
+            self._ids[key] = len(self.nodes) + 1
+            props = {NAME_PROPERTY: name}
+            props.update({k: v for k, v in properties.items() if v is not None})
+            self.nodes.append({"id": self._ids[key], "name": name, "type": type_name, "properties": props})
+        return self._ids[key]
+
+    def properties(self, node_id: int) -> Dict[str, Any]:
+        return self.nodes[node_id - 1]["properties"]
+
+    def relationship(self, rel_type: str, from_id: int, to_id: int):
+        if (rel_type, from_id, to_id) not in self._relation_keys:
+            self._relation_keys.add((rel_type, from_id, to_id))
+            self.relationships.append({"name": rel_type, "type": rel_type, "from": from_id, "to": to_id})
+
+    def device(self, code: str, description: str = "") -> int:
+        """设备节点，描述中的参见引用拆为参见节点"""
+        references = []
+        if self.has(REFERENCE_TYPE, REFERENCE_RELATION):
+            references = [re.sub(r"\s+", " ", m) for m in REFERENCE_PATTERN.findall(description)]
+            description = REFERENCE_PATTERN.sub("", description)
+        description = description.strip(" -–—:：,，;；.。")
+        name = f"{code} - {description}" if description else code
+        device_id = self.node(DEVICE_TYPE, name, **({"缩写": code} if "缩写" in self.entity_types[DEVICE_TYPE] else {}))
+        for reference in references:
+            self.relationship(REFERENCE_RELATION, device_id, self.node(REFERENCE_TYPE, reference))
+        return device_id
+
+    def result(self) -> Dict[str, Any]:
+        return {"nodes": self.nodes, "relationships": self.relationships}
+
+
+def is_page_furniture(rows: List[List[str]]) -> bool:
+    """页眉页脚表格：X6 手册每页的更新日期/印刷板页脚、页码页脚与“X6 | 章节名 | 02”页眉，其他表格一律不算"""
+    cells = [cell for row in rows for cell in row if cell]
+    if all(any(keyword in cell for cell in cells) for keyword in PAGE_FOOTER_KEYWORDS):
+        return True
+    if PAGE_NUMBER_PATTERN.fullmatch(" ".join(cells)):
+        return True
+    if len(rows) != 1 or len(rows[0]) != 3:
+        return False
+    ends = rows[0][0], rows[0][2]
+    return PAGE_HEADER_MODEL in ends and any(PAGE_HEADER_CHAPTER_PATTERN.fullmatch(cell) for cell in ends)
+
+
+def _device_rows(rows: List[List[str]]) -> Optional[List[Tuple[List[str], str]]]:
+    """首列为设备代码的表格（允许一行表头），返回每行的 (设备代码列表, 描述)，不是此类表格时返回 None"""
+    rows = [[cell for cell in row if cell] for row in rows]
+    rows = [row for row in rows if row]
+    if rows and not DEVICE_CODE_PATTERN.fullmatch(rows[0][0]):
+        rows = rows[1:]
+    if not rows or not all(DEVICE_CODE_PATTERN.fullmatch(row[0]) for row in rows):
+        return None
+    parsed = []
+    for row in rows:
+        codes = [cell for cell in row if DEVICE_CODE_PATTERN.fullmatch(cell)]
+        if len(codes) == len(row):
+            parsed.append((codes, ""))
+        else:
+            parsed.append(([row[0]], " ".join(row[1:])))
+    return parsed
+
+
+def _parameter_rows(rows: List[List[str]]) -> Optional[List[Tuple[str, str]]]:
+    """“参数名”与“参见 …-参数”交替排列的参数表格，返回 (参数名, 参见) 列表"""
+    cells = [cell for row in rows for cell in row if cell]
+    pairs = []
+    name = None
+    for cell in cells:
+        reference = REFERENCE_PATTERN.fullmatch(cell)
+        if reference is None:
+            if name is not None:
+                return None
+            name = cell
+        else:
+            pairs.append((name, re.sub(r"\s+", " ", cell)))
+            name = None
+    return pairs if pairs and name is None else None
+
+
+def _extract_table(rows: List[List[str]], builder: _GraphBuilder, state: Dict[str, Any]) -> bool:
+    """按已识别的版式把表格转为节点与关系，返回 False 表示版式未识别，表格留给大模型抽取"""
+    if not rows or not builder.has(DEVICE_TYPE):
+        return False
+
+    labels = {row[0]: row[1] for row in rows if len(row) >= 2 and row[0] and row[1]}
+    if SUBPROCESS_LABEL in labels:
+        state["subject"] = builder.node(DEVICE_TYPE, labels[SUBPROCESS_LABEL])
+        return True
+
+    devices = _device_rows(rows)
+    if devices is not None:
+        for codes, description in devices:
+            for code in codes:
+                builder.device(code, description)
+        return True
+
+    parameters = _parameter_rows(rows)
+    if parameters is not None and state.get("subject") is not None \
+            and builder.has(REFERENCE_TYPE, REFERENCE_RELATION):
+        subject = state["subject"]
+        names = builder.properties(subject).setdefault("参数", [])
+        for name, reference in parameters:
+            if name and name not in names:
+                names.append(name)
+            builder.relationship(REFERENCE_RELATION, subject, builder.node(REFERENCE_TYPE, reference))
+        return True
+    return False
+
+
+def _index_blocks(text: str) -> List[Tuple[int, int, List[Tuple[str, str]]]]:
+    """连续的缩写索引行（中间可有空行），返回 (起点, 终点, [(设备代码, 描述)])"""
+    blocks = []
+    current = []
+    pos = 0
+    for line in text.splitlines(keepends=True):
+        start, pos = pos, pos + len(line)
+        if not line.strip():
+            continue
+        match = INDEX_LINE_PATTERN.match(plain_text(line))
+        if match and DEVICE_CODE_PATTERN.fullmatch(match.group(1)):
+            current.append((start, pos, match.group(1), match.group(2)))
+            continue
+        if len(current) >= INDEX_MIN_LINES:
+            blocks.append((current[0][0], current[-1][1], [(code, desc) for _, _, code, desc in current]))
+        current = []
+    if len(current) >= INDEX_MIN_LINES:
+        blocks.append((current[0][0], current[-1][1], [(code, desc) for _, _, code, desc in current]))
+    return blocks
+
+
+def extract_tables(text: str, prompt: str) -> Tuple[Dict[str, Any], str, int]:
+    """不经大模型，把分块中已识别版式的表格直接转为 nodes/relationships
+
+    识别的版式：X6 手册的页眉页脚（丢弃，不计入表格数）、首列为设备代码的信号表与缩写索引（设备，描述中的参见拆为参见节点）、
+    监视器子进程表格及其后的参数表格（子进程为设备，参数名记在其“参数”属性上，参见为参见节点）。
+    只生成提示词本体中定义的类型，未识别的表格保留在文本中。
+    返回 (抽取结果, 去除已识别表格后的文本, 识别的表格数)。
+    """
+    builder = _GraphBuilder(prompt)
+    state = {}
+    spans = []
+    count = 0
+    tables = [(m.start(), m.end(), parse_html_table(m.group(0))) for m in HTML_TABLE_PATTERN.finditer(text)]
+    tables += [(m.start(), m.end(), parse_pipe_table(m.group(0))) for m in PIPE_TABLE_PATTERN.finditer(text)]
+    for start, end, rows in sorted(tables, key=lambda t: t[0]):
+        if is_page_furniture(rows):
+            spans.append((start, end))
+        elif _extract_table(rows, builder, state):
+            spans.append((start, end))
+            count += 1
+    if builder.has(DEVICE_TYPE):
+        for start, end, entries in _index_blocks(text):
+            if any(start < s_end and s_start < end for s_start, s_end in spans):
+                continue
+            for code, description in entries:
+                builder.device(code, description)
+            spans.append((start, end))
+            count += 1
+
+    if not spans:
+        return builder.result(), text, 0
+    pieces = []
+    pos = 0
+    for start, end in sorted(spans):
+        pieces.append(text[pos:start])
+        pos = end
+    pieces.append(text[pos:])
+    remaining = re.sub(r"\n{3,}", "\n\n", "".join(pieces))
+    return builder.result(), remaining, count
@@ -1,29 +1,489 @@
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import TextLoader, UnstructuredMarkdownLoader
+import bisect
+import os
 import re
-from typing import List
+from collections import deque
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 
+from app.utils.token_budget import count_tokens, get_model_budget, predict_output_tokens
 
-def text_split(file_path: str):
-    # TODO:更改为实际文件
-    loader = TextLoader(file_path, encoding="utf-8")
-    documents = loader.load()
+# 按字符分块的分隔符，与原 LangChain RecursiveCharacterTextSplitter 配置一致（"" 表示逐字切分，其后的 "\n" 不会用到）
+SEPARATORS = ["\n\n", "。", "；", " ", "", "\n"]
+# 超长文本块依次尝试的分隔符，最后按字符硬切
+BLOCK_SEPARATORS = ["\n", "。", "；", " "]
+# pdf2md 在每页开头写入的页码标记，渲染时不可见
+PAGE_MARKER_PATTERN = re.compile(r"<!-- page (\d+) -->\n\n")
+PAGE_MARKER_LINE_PATTERN = re.compile(r"^<!-- page (\d+) -->\n$")
+MD_HEADING_PATTERN = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t#]*$", re.M)
+MD_IMAGE_PATTERN = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+WORD_PATTERN = re.compile(r"\w")
 
-    # 配置递归字符文本分割器
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=3000,  # 每个块的最大字符数
-        chunk_overlap=300,  # 块之间的重叠字符数
-        separators=["\n\n", "。", "；", " ", "", "\n"]  # 中文友好的分隔符
-    )
 
-    chunks = text_splitter.split_documents(documents)
+class TextChunk:
+    """分块文本与元数据，与 LangChain Document 一样提供 page_content 与 metadata"""
 
+    def __init__(self, page_content: str, metadata: Optional[dict] = None):
+        self.page_content = page_content
+        self.metadata = metadata or {}
+
+    def __repr__(self):
+        return f"TextChunk(metadata={self.metadata}, page_content={self.page_content!r})"
+
+
+def _iter_pieces(text: str, start: int, end: int, separator: str) -> Iterator[Tuple[int, int]]:
+    """按分隔符切分 text[start:end]，分隔符保留在下一片段开头，返回各片段的 (起点, 终点)"""
+    if separator == "":
+        for pos in range(start, end):
+            yield pos, pos + 1
+        return
+    piece_start = start
+    pos = text.find(separator, start, end)
+    while pos != -1:
+        if pos > piece_start:
+            yield piece_start, pos
+        piece_start = pos
+        pos = text.find(separator, pos + len(separator), end)
+    if end > piece_start:
+        yield piece_start, end
+
+
+def _iter_split(text: str, start: int, end: int, separators: List[str], chunk_size: int,
+                chunk_overlap: int) -> Iterator[Tuple[int, int, bool]]:
+    """递归字符分块，返回 (起点, 终点, 是否去除首尾空白)
+
+    与 RecursiveCharacterTextSplitter 的语义一致：取区间内第一个出现的分隔符切分，
+    短于 chunk_size 的片段依次合并并保留不超过 chunk_overlap 的重叠，超长片段用后续分隔符递归切分。
+    合并窗口用双端队列维护，每个字符在每一级分隔符上只处理一次。
+    """
+    separator = separators[-1]
+    rest = []
+    for index, candidate in enumerate(separators):
+        if candidate == "":
+            separator = ""
+            break
+        if text.find(candidate, start, end) != -1:
+            separator = candidate
+            rest = separators[index + 1:]
+            break
+
+    window = deque()
+    total = 0
+    for piece_start, piece_end in _iter_pieces(text, start, end, separator):
+        length = piece_end - piece_start
+        if length < chunk_size:
+            if window and total + length > chunk_size:
+                yield window[0][0], window[-1][1], True
+                while window and (total > chunk_overlap or total + length > chunk_size):
+                    first_start, first_end = window.popleft()
+                    total -= first_end - first_start
+            window.append((piece_start, piece_end))
+            total += length
+            continue
+        if window:
+            yield window[0][0], window[-1][1], True
+            window.clear()
+            total = 0
+        if rest:
+            yield from _iter_split(text, piece_start, piece_end, rest, chunk_size, chunk_overlap)
+        else:
+            yield piece_start, piece_end, False
+    if window:
+        yield window[0][0], window[-1][1], True
+
+
+def split_text(text: str, chunk_size: int = 3000, chunk_overlap: int = 300,
+               separators: Optional[List[str]] = None, metadata: Optional[dict] = None) -> Iterator[TextChunk]:
+    """单遍扫描的递归字符分块，按顺序惰性产出分块，metadata["start"] 为分块在原文中的起始偏移"""
+    for start, end, strip in _iter_split(text, 0, len(text), separators or SEPARATORS, chunk_size, chunk_overlap):
+        if strip:
+            while start < end and text[start].isspace():
+                start += 1
+            while end > start and text[end - 1].isspace():
+                end -= 1
+            if start == end:
+                continue
+        yield TextChunk(text[start:end], {**(metadata or {}), "start": start})
+
+
+def iter_text_split(file_path: str, chunk_size: int = 3000, chunk_overlap: int = 300) -> Iterator[TextChunk]:
+    """读取文件并按字符惰性分块"""
+    with open(file_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    return split_text(text, chunk_size, chunk_overlap, metadata={"source": file_path})
+
+
+def text_split(file_path: str) -> List[TextChunk]:
+    """按 3000 字符、300 字符重叠分块"""
+    return list(iter_text_split(file_path))
+
+
+def _split_block(text: str, start: int, end: int, max_input: int, max_output: int, compact: bool,
+                 separators: List[str]) -> List[Tuple[int, int, int, int]]:
+    """把 text[start:end] 切成输入与预测输出都不超出预算的单元，返回 (起点, 终点, 输入token, 预测输出token)"""
+    block = text[start:end]
+    input_tokens = count_tokens(block)
+    output_tokens = predict_output_tokens(block, input_tokens, compact)
+    if (input_tokens <= max_input and output_tokens <= max_output) or end - start <= 1:
+        return [(start, end, input_tokens, output_tokens)]
+    for index, separator in enumerate(separators):
+        positions = [m.end() for m in re.finditer(re.escape(separator), block)]
+        positions = [start + pos for pos in positions if pos < len(block)]
+        if positions:
+            units = []
+            for piece_start, piece_end in zip([start] + positions, positions + [end]):
+                units.extend(_split_block(text, piece_start, piece_end, max_input, max_output, compact,
+                                          separators[index + 1:]))
+            return units
+    # 没有可用的分隔符时按超出比例硬切
+    ratio = max(input_tokens / max_input, output_tokens / max_output)
+    step = max(1, int((end - start) / ratio))
+    units = []
+    for piece_start in range(start, end, step):
+        units.extend(_split_block(text, piece_start, min(end, piece_start + step), max_input, max_output, compact, []))
+    return units
+
+
+def split_text_by_tokens(text: str, max_input_tokens: int, max_output_tokens: int,
+                         overlap_tokens: int = 150, compact: bool = False) -> List[TextChunk]:
+    """按模型 token 预算分块
+
+    先按空行切分段落，超出预算的段落再依次按换行、句号、分号、空格切分；
+    再把段落依次装入分块，直到输入 token 数达到 max_input_tokens 或按内容类型预测的输出 token 数达到 max_output_tokens。
+    相邻分块重叠不超过 overlap_tokens 的末尾段落。分块内容为原文连续片段，metadata 记录起止偏移与 token 预算。
+    """
+    units = []
+    paragraph_start = 0
+    for match in re.finditer(r"\n\n+", text):
+        units.extend(_split_block(text, paragraph_start, match.end(), max_input_tokens, max_output_tokens, compact,
+                                  BLOCK_SEPARATORS))
+        paragraph_start = match.end()
+    if paragraph_start < len(text):
+        units.extend(_split_block(text, paragraph_start, len(text), max_input_tokens, max_output_tokens, compact,
+                                  BLOCK_SEPARATORS))
+
+    chunks = []
+
+    def emit(current):
+        start, end = current[0][0], current[-1][1]
+        chunks.append(TextChunk(text[start:end], {
+            "start": start,
+            "end": end,
+            "input_tokens": sum(unit[2] for unit in current),
+            "predicted_output_tokens": sum(unit[3] for unit in current),
+        }))
+
+    current = []
+    for unit in units:
+        if current and (sum(u[2] for u in current) + unit[2] > max_input_tokens
+                        or sum(u[3] for u in current) + unit[3] > max_output_tokens):
+            emit(current)
+            # 取末尾不超过 overlap_tokens 的段落作为下一分块的开头
+            overlap = []
+            for previous in reversed(current[1:]):
+                if sum(u[2] for u in overlap) + previous[2] > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+            if (sum(u[2] for u in overlap) + unit[2] > max_input_tokens
+                    or sum(u[3] for u in overlap) + unit[3] > max_output_tokens):
+                overlap = []
+            current = overlap
+        current.append(unit)
+    if current and text[current[0][0]:current[-1][1]].strip():
+        emit(current)
+    return chunks
+
+
+class HeadingSection:
+    """标题树中的一个章节：从标题行到下一个标题之前的文本，path 为从顶级标题到本标题的标题路径"""
+
+    def __init__(self, path: List[str], start: int, end: int):
+        self.path = path
+        self.start = start
+        self.end = end
+
+
+def parse_heading_tree(text: str, order: str = "auto") -> List[HeadingSection]:
+    """解析 markdown 标题树，按先序返回各章节
+
+    order 为 normal 时 "#" 最高级；为 inverted 时 "#" 越多级别越高（X6 手册的预处理结果中
+    "####" 为一级标题、"###" 为二级、"##" 为三级）；auto 时第一个标题的 "#" 多于全文最少的 "#" 则视为 inverted。
+    第一个标题之前的内容作为标题路径为空的章节。
+    """
+    matches = list(MD_HEADING_PATTERN.finditer(text))
+    if not matches:
+        return [HeadingSection([], 0, len(text))] if text else []
+    if order == "auto":
+        order = "inverted" if len(matches[0].group(1)) > min(len(m.group(1)) for m in matches) else "normal"
+
+    sections = []
+    if matches[0].start() > 0:
+        sections.append(HeadingSection([], 0, matches[0].start()))
+    stack = []  # (级别, 标题)，级别越小越高
+    for index, match in enumerate(matches):
+        marks = len(match.group(1))
+        rank = 7 - marks if order == "inverted" else marks
+        while stack and stack[-1][0] >= rank:
+            stack.pop()
+        stack.append((rank, match.group(2).strip()))
+        end = matches[index + 1].start() if index + 1 < len(matches) else len(text)
+        sections.append(HeadingSection([title for _, title in stack], match.start(), end))
+    return sections
+
+
+def split_text_by_headings(text: str, max_input_tokens: int, max_output_tokens: int,
+                          overlap_tokens: int = 150, compact: bool = False, order: str = "auto") -> List[TextChunk]:
+    """沿章节边界分块，metadata["heading_path"] 为分块开头所属的上级标题路径
+
+    同一顶级标题下的相邻章节在预算内合并为一个分块，分块之间不重叠；
+    超出预算的单个章节再按 token 预算切分，只有这种情况下才保留 overlap_tokens 的重叠。
+    """
+    chunks = []
+    current = []
+    totals = [0, 0]
+
+    def flush():
+        if not current:
+            return
+        start, end = current[0].start, current[-1].end
+        if text[start:end].strip():
+            chunks.append(TextChunk(text[start:end], {
+                "start": start,
+                "end": end,
+                "input_tokens": totals[0],
+                "predicted_output_tokens": totals[1],
+                "heading_path": current[0].path[:-1],
+            }))
+        current.clear()
+        totals[0] = totals[1] = 0
+
+    for section in parse_heading_tree(text, order):
+        section_text = text[section.start:section.end]
+        input_tokens = count_tokens(section_text)
+        output_tokens = predict_output_tokens(section_text, input_tokens, compact)
+        if input_tokens > max_input_tokens or output_tokens > max_output_tokens:
+            flush()
+            for piece in split_text_by_tokens(section_text, max_input_tokens, max_output_tokens, overlap_tokens, compact):
+                # 第一段包含本章节标题行，之后各段以本章节标题作为上下文
+                piece.metadata["heading_path"] = section.path[:-1] if piece.metadata["start"] == 0 else section.path
+                piece.metadata["start"] += section.start
+                piece.metadata["end"] += section.start
+                chunks.append(piece)
+            continue
+        if current and (totals[0] + input_tokens > max_input_tokens
+                        or totals[1] + output_tokens > max_output_tokens
+                        or current[0].path[:1] != section.path[:1]):
+            flush()
+        current.append(section)
+        totals[0] += input_tokens
+        totals[1] += output_tokens
+    flush()
     return chunks
 
 
-# TODO:按页分块
-def split_text_by_pages():
-    pass
+def heading_context(chunk) -> str:
+    """分块所属的上级标题路径前缀，没有时为空串"""
+    path = chunk.metadata.get("heading_path") if getattr(chunk, "metadata", None) else None
+    if not path:
+        return ""
+    return f"所属章节：{' > '.join(path)}\n\n"
+
+
+def chunk_text_with_context(chunk, content: Optional[str] = None) -> str:
+    """在分块文本（或替换后的 content）前附加其所属的上级标题路径，作为抽取时的紧凑上下文"""
+    content = chunk.page_content if content is None else content
+    return heading_context(chunk) + content
+
+
+def chunk_budget(model_name: str, prompt: str = "") -> Tuple[int, int, int]:
+    """返回 (输入上限, 预测输出上限, 重叠 token 数)：输入上限为 CHUNK_MAX_INPUT_TOKENS 与上下文剩余空间中的较小值，
+    预测输出不超过单次输出上限的 CHUNK_OUTPUT_SAFETY 倍"""
+    budget = get_model_budget(model_name)
+    max_output = int(budget.max_output_tokens * float(os.getenv("CHUNK_OUTPUT_SAFETY", "0.8")))
+    max_input = min(int(os.getenv("CHUNK_MAX_INPUT_TOKENS", "2000")),
+                    budget.context_tokens - budget.max_output_tokens - count_tokens(prompt) - 64)
+    if max_input <= 0:
+        raise ValueError(f"提示词过长，模型 {model_name} 的上下文中没有留给分块的空间")
+    return max_input, max_output, int(os.getenv("CHUNK_OVERLAP_TOKENS", "150"))
+
+
+def text_split_by_tokens(file_path: str, model_name: str, prompt: str = "", compact: bool = False,
+                         by_headings: bool = False) -> List[TextChunk]:
+    """按模型预算对整个文件分块，by_headings 为真时沿标题树的章节边界分块"""
+    with open(file_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    max_input, max_output, overlap_tokens = chunk_budget(model_name, prompt)
+    if by_headings:
+        order = os.getenv("MD_HEADING_ORDER", "auto")
+        splitter = lambda *args, **kwargs: split_text_by_headings(*args, order=order, **kwargs)
+    else:
+        splitter = split_text_by_tokens
+    if PAGE_MARKER_PATTERN.search(text):
+        split = lambda *args, **kwargs: split_text_by_pages(*args, splitter=splitter, **kwargs)
+    else:
+        split = splitter
+    return split(text, max_input, max_output, overlap_tokens=overlap_tokens, compact=compact)
+
+
+def iter_file_segments(file_path: str, max_chars: int = 64 * 1024) -> Iterator[Tuple[Optional[int], str]]:
+    """逐行读取文件，按页码标记生成 (页码, 页面正文)，不读入整个文件
+
+    没有页码标记的内容（如标记前的内容或普通 markdown）页码为 None，并在超过 max_chars 后的空行处分段。
+    """
+    page_number = None
+    lines = []
+    size = 0
+    with open(file_path, "r", encoding="utf-8") as f:
+        pending_marker, pending_marker_line = None, ""
+        for line in f:
+            if pending_marker is not None:
+                if line == "\n":
+                    # 页码标记行与其后的空行构成完整标记
+                    if lines:
+                        yield page_number, "".join(lines)
+                    page_number, lines, size = pending_marker, [], 0
+                    pending_marker = None
+                    continue
+                lines.append(pending_marker_line)
+                size += len(pending_marker_line)
+                pending_marker = None
+            match = PAGE_MARKER_LINE_PATTERN.match(line)
+            if match:
+                pending_marker, pending_marker_line = int(match.group(1)), line
+                continue
+            lines.append(line)
+            size += len(line)
+            if page_number is None and size >= max_chars and line == "\n":
+                yield page_number, "".join(lines)
+                lines, size = [], 0
+        if pending_marker is not None:
+            lines.append(pending_marker_line)
+    if lines:
+        yield page_number, "".join(lines)
+
+
+def iter_split_by_tokens(segments: Iterable[Tuple[Optional[int], str]], max_input_tokens: int, max_output_tokens: int,
+                         overlap_tokens: int = 150, compact: bool = False,
+                         window_tokens: Optional[int] = None) -> Iterator[TextChunk]:
+    """流式按 token 预算分块，内存占用只与窗口大小有关
+
+    依次读入 (页码, 页面正文)，缓冲区达到 window_tokens（默认输入上限的 4 倍）后用 split_text_by_tokens 分块，
+    输出除最后一个以外的分块，缓冲区从最后一个分块的起点继续；metadata 中的偏移为去掉页码标记后的全文偏移，
+    有页码时 metadata["pages"] 为分块覆盖的 [起始页, 结束页]。
+    """
+    window_tokens = window_tokens or max_input_tokens * 4
+    buffer = ""
+    base = 0
+    buffer_tokens = 0
+    offsets = []
+    pages = []
+
+    def split(final: bool) -> List[TextChunk]:
+        nonlocal buffer, base, buffer_tokens, offsets, pages
+        chunks = split_text_by_tokens(buffer, max_input_tokens, max_output_tokens, overlap_tokens, compact)
+        keep = None if final or len(chunks) < 2 else chunks.pop()
+        for chunk in chunks:
+            chunk.metadata["start"] += base
+            chunk.metadata["end"] += base
+            if pages:
+                first = max(bisect.bisect_right(offsets, chunk.metadata["start"]) - 1, 0)
+                last = max(bisect.bisect_left(offsets, chunk.metadata["end"]) - 1, first)
+                chunk.metadata["pages"] = [pages[first], pages[last]]
+        if keep is not None:
+            cut = keep.metadata["start"]
+            buffer = buffer[cut:]
+            base += cut
+            buffer_tokens = count_tokens(buffer)
+            # 只保留与缓冲区相交的页
+            first = max(bisect.bisect_right(offsets, base) - 1, 0)
+            offsets, pages = offsets[first:], pages[first:]
+        return chunks
+
+    for page_number, text in segments:
+        if page_number is not None:
+            offsets.append(base + len(buffer))
+            pages.append(page_number)
+        buffer += text
+        buffer_tokens += count_tokens(text)
+        if buffer_tokens >= window_tokens:
+            yield from split(final=False)
+    if buffer:
+        yield from split(final=True)
+
+
+def iter_text_split_by_tokens(file_path: str, model_name: str, prompt: str = "",
+                              compact: bool = False) -> Iterator[TextChunk]:
+    """按模型预算流式读取并分块，适用于超大的预处理文件"""
+    max_input, max_output, overlap_tokens = chunk_budget(model_name, prompt)
+    return iter_split_by_tokens(iter_file_segments(file_path), max_input, max_output, overlap_tokens, compact)
+
+
+def is_blank_text(text: str) -> bool:
+    """去除图片引用与页码标记后不含任何文字（如扫描页或只有图片的分块）"""
+    text = PAGE_MARKER_PATTERN.sub("", MD_IMAGE_PATTERN.sub("", text))
+    return WORD_PATTERN.search(text) is None
+
+
+def split_in_half(text: str, min_chars: int = 200):
+    """在最靠近中点的段落边界处将文本一分为二，依次尝试空行、换行、句号
+
+    文本过短或找不到任何边界时返回 None。
+    """
+    if len(text) < min_chars * 2:
+        return None
+    middle = len(text) // 2
+    for separator in ["\n\n", "\n", "。", "；"]:
+        before = text.rfind(separator, 0, middle)
+        after = text.find(separator, middle)
+        positions = [pos + len(separator) for pos in (before, after) if pos != -1]
+        positions = [pos for pos in positions if min_chars <= pos <= len(text) - min_chars]
+        if positions:
+            cut = min(positions, key=lambda pos: abs(pos - middle))
+            return text[:cut], text[cut:]
+    return None
+
+
+def join_pages(pages: List[Tuple[int, str]]) -> str:
+    """把 (页码, 页面 markdown) 拼接为带页码标记的文本，每页以空行结尾，保证页边界同时是段落边界"""
+    parts = []
+    for page_number, page_text in pages:
+        if not page_text.endswith("\n\n"):
+            page_text = page_text.rstrip("\n") + "\n\n"
+        parts.append(f"<!-- page {page_number} -->\n\n{page_text}")
+    return "".join(parts)
+
+
+def strip_page_markers(text: str) -> Tuple[str, List[int], List[int]]:
+    """去掉页码标记，返回 (正文, 各页在正文中的起始偏移, 对应页码)"""
+    parts = []
+    offsets = []
+    pages = []
+    length = 0
+    last = 0
+    for match in PAGE_MARKER_PATTERN.finditer(text):
+        parts.append(text[last:match.start()])
+        length += match.start() - last
+        offsets.append(length)
+        pages.append(int(match.group(1)))
+        last = match.end()
+    parts.append(text[last:])
+    return "".join(parts), offsets, pages
+
+
+def split_text_by_pages(text: str, max_input_tokens: int, max_output_tokens: int,
+                        overlap_tokens: int = 150, compact: bool = False,
+                        splitter: Callable[..., List[TextChunk]] = split_text_by_tokens) -> List[TextChunk]:
+    """按页码标记感知页边界分块，metadata["pages"] 为分块覆盖的 [起始页, 结束页]
+
+    页边界总是段落边界，分块在预算内可跨页；标记前的内容（如有）计入第一页。
+    """
+    clean_text, offsets, pages = strip_page_markers(text)
+    chunks = splitter(clean_text, max_input_tokens, max_output_tokens, overlap_tokens, compact)
+    if not pages:
+        return chunks
+    for chunk in chunks:
+        first = max(bisect.bisect_right(offsets, chunk.metadata["start"]) - 1, 0)
+        last = max(bisect.bisect_left(offsets, chunk.metadata["end"]) - 1, first)
+        chunk.metadata["pages"] = [pages[first], pages[last]]
+    return chunks
 
 
 # 按 token 分块
@@ -0,0 +1,117 @@
+import json
+import os
+import re
+import threading
+from typing import Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+from app.utils.llm_scheduler import estimate_tokens
+
+TABLE_LINE_PATTERN = re.compile(r"^\s*\|")
+LIST_LINE_PATTERN = re.compile(r"^\s*([-*+]|\d+[.、)）])\s")
+HEADING_LINE_PATTERN = re.compile(r"^\s*#{1,6}\s")
+
+# 各类内容每个输入 token 预计产生的输出 token 数（按原 JSON 格式输出估计，紧凑格式约为一半）
+# 由 kg_output/x6_* 已有抽取结果统计：正文中位数约 1.1，列表与标题密集的分块更高，表格每个单元格都会成为节点
+DEFAULT_OUTPUT_RATIOS = {"prose": 1.1, "list": 1.4, "heading": 1.6, "table": 1.8}
+COMPACT_OUTPUT_FACTOR = 0.5
+
+# 未在 MODEL_TOKEN_BUDGETS 中配置的模型使用的默认预算
+DEFAULT_CONTEXT_TOKENS = 32768
+DEFAULT_MAX_OUTPUT_TOKENS = 8192
+
+
+def load_tokenizer(spec: str) -> Callable[[str], int]:
+    """按配置加载本地分词器，返回计算 token 数的函数
+
+    - estimate：按字符类别估算（默认，无额外依赖）；
+    - tiktoken:<编码名>，如 tiktoken:cl100k_base，需要安装 tiktoken；
+    - hf:<tokenizer.json 路径或模型目录>，如 hf:autodl-tmp/models/Qwen2.5-7B-Instruct，需要安装 tokenizers 或 transformers。
+    """
+    kind, _, arg = spec.partition(":")
+    if kind == "estimate":
+        return estimate_tokens
+    if kind == "tiktoken":
+        import tiktoken
+        encoding = tiktoken.get_encoding(arg or "cl100k_base")
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    if kind == "hf":
+        path = os.path.join(arg, "tokenizer.json") if os.path.isdir(arg) else arg
+        try:
+            from tokenizers import Tokenizer
+            tokenizer = Tokenizer.from_file(path)
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+        except ImportError:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(arg)
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+    raise ValueError(f"不支持的分词器配置: {spec}")
+
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def count_tokens(text: str) -> int:
+    """用 TOKENIZER 配置的分词器计算 token 数，分词器加载失败时退回估算"""
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                load_dotenv()
+                spec = os.getenv("TOKENIZER", "estimate")
+                try:
+                    _tokenizer = load_tokenizer(spec)
+                except Exception as e:
+                    print(f"加载分词器 {spec} 失败，改用估算: {e}")
+                    _tokenizer = estimate_tokens
+    return _tokenizer(text)
+
+
+class ModelBudget:
+    """模型的上下文长度与单次输出上限"""
+
+    def __init__(self, context_tokens: int = DEFAULT_CONTEXT_TOKENS, max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS):
+        self.context_tokens = context_tokens
+        self.max_output_tokens = max_output_tokens
+
+
+def get_model_budget(model_name: str) -> ModelBudget:
+    """读取 MODEL_TOKEN_BUDGETS 中该模型的预算，例如
+    {"deepseek-chat": {"context_tokens": 65536, "max_output_tokens": 8192}}
+    """
+    load_dotenv()
+    config = os.getenv("MODEL_TOKEN_BUDGETS", "").strip()
+    budgets: Dict[str, Dict[str, int]] = json.loads(config) if config else {}
+    entry = budgets.get(model_name, {})
+    return ModelBudget(
+        context_tokens=int(entry.get("context_tokens", DEFAULT_CONTEXT_TOKENS)),
+        max_output_tokens=int(entry.get("max_output_tokens", DEFAULT_MAX_OUTPUT_TOKENS)),
+    )
+
+
+def classify_block(block: str) -> str:
+    """按行判断文本块的内容类型：表格、列表、标题密集或正文"""
+    lines = [line for line in block.split("\n") if line.strip()]
+    if not lines:
+        return "prose"
+    table = sum(1 for line in lines if TABLE_LINE_PATTERN.match(line))
+    if table * 2 >= len(lines):
+        return "table"
+    listed = sum(1 for line in lines if LIST_LINE_PATTERN.match(line))
+    if listed * 2 >= len(lines):
+        return "list"
+    headings = sum(1 for line in lines if HEADING_LINE_PATTERN.match(line))
+    if headings * 3 >= len(lines):
+        return "heading"
+    return "prose"
+
+
+def predict_output_tokens(block: str, input_tokens: int, compact: bool = False,
+                          ratios: Optional[Dict[str, float]] = None) -> int:
+    """按内容类型预测抽取该文本块产生的输出 token 数"""
+    ratio = (ratios or DEFAULT_OUTPUT_RATIOS)[classify_block(block)]
+    if compact:
+        ratio *= COMPACT_OUTPUT_FACTOR
+    return int(input_tokens * ratio) + 1
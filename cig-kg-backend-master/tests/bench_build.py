@@ -0,0 +1,181 @@
+"""
+离线端到端构建压测：上传 → pdf2md → 分块 → 抽取 → 导入，大模型调用指向本地模拟服务。
+
+用法（在项目根目录下）：
+    python -m tests.bench_build path/to/manual.pdf --workers 8 --latency lognormal:0.0,0.5 --error-rate 0.02
+    python -m tests.bench_build doc_preprocessed/X6_1.md --skip-import      # markdown 输入跳过 pdf2md，不连接 Neo4j
+
+默认在进程内启动 tests/mock_llm_server.py，传 --base-url 时改为调用已启动的服务。
+输出各阶段耗时、每秒处理分块数与构建统计。抽取与导入是流水线并行的，两者的累计耗时之和会大于墙钟时间。
+--skip-import 时分块只经过导入队列而不写入 Neo4j，报告中导入与合并阶段及 chunks_imported 记为 skipped。
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from tests import mock_llm_server
+
+DEFAULT_PROMPT = "请从文本中抽取设备、参数与标题等实体及其关系，以 JSON 格式输出 nodes 与 relationships。"
+
+
+class StageTimer:
+    """累计各阶段耗时，多个线程同时处于同一阶段时累加各自的耗时"""
+
+    def __init__(self):
+        self.seconds = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    def timed(self, stage: str, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+
+def configure_environment(args):
+    """在导入 app 模块前设置环境变量，使共享客户端、端点池与缓存指向压测配置"""
+    os.environ["BASE_URL"] = args.base_url
+    os.environ["API_KEY"] = "EMPTY"
+    os.environ["MODEL_NAME"] = "mock-model"
+    os.environ["LLM_BACKENDS"] = ""
+    os.environ["LLM_HEALTH_CHECK_SECONDS"] = "0"
+    os.environ["LLM_MAX_CONCURRENCY"] = str(max(args.workers, 1))
+    if not args.use_cache:
+        cache_dir = tempfile.mkdtemp(prefix="bench_cache_")
+        os.environ["LLM_CACHE_PATH"] = os.path.join(cache_dir, "llm_cache.sqlite3")
+        os.environ["DEDUP_INDEX_PATH"] = os.path.join(cache_dir, "dedup_index.sqlite3")
+
+
+def run(args) -> dict:
+    configure_environment(args)
+
+    from app.services import kg_build_service
+    from app.services.kg_build_service import KGBuildService
+    from app.services.pdf_service import PDFService
+    from app.utils.llm_scheduler import get_llm_scheduler
+
+    timer = StageTimer()
+    wall_start = time.perf_counter()
+
+    # 1. 上传：与 /api/build/kg_build 相同，先复制到 uploads 目录
+    file_name = os.path.basename(args.file)
+    doc_name = os.path.splitext(file_name)[0]
+    os.makedirs("uploads", exist_ok=True)
+    upload_path = os.path.join("uploads", f"{uuid.uuid4()}_{file_name}")
+    timer.timed("upload", shutil.copyfile, args.file, upload_path)
+
+    work_dir = tempfile.mkdtemp(prefix="bench_build_")
+    try:
+        # 2. pdf2md，输入已是 markdown 时跳过
+        if file_name.lower().endswith(".pdf"):
+            md_path = os.path.join(work_dir, f"{doc_name}.md")
+            timer.timed("pdf2md", PDFService().write_markdown, upload_path, md_path, document_name=file_name)
+        else:
+            md_path = upload_path
+
+        # 3. 分块：单独计时一次，build_graph 内部会再流式分块
+        service = KGBuildService()
+        chunks = timer.timed("split", lambda: list(service.split_chunks(md_path, args.prompt)))
+
+        # 4/5. 抽取与导入：包装抽取函数与导入器以统计各阶段累计耗时
+        extract = service.extract_kg_elements
+        # 输出截断后的递归拆分抽取计入顶层调用的耗时
+        service.extract_kg_elements = lambda *a, **kw: (timer.timed("extract", extract, *a, **kw)
+                                                        if not kw.get("depth") else extract(*a, **kw))
+        importer_class = kg_build_service.Neo4jImporter
+
+        class TimedImporter:
+            def __init__(self, database):
+                self.importer = None if args.skip_import else importer_class(database=database)
+
+            def import_data(self, data, source_name):
+                if self.importer is not None:
+                    timer.timed("import", self.importer.import_data, data, source_name)
+
+            def delete_source(self, source_name):
+                if self.importer is not None:
+                    timer.timed("import", self.importer.delete_source, source_name)
+
+            def merge_duplicate_nodes(self):
+                if self.importer is not None:
+                    timer.timed("merge", self.importer.merge_duplicate_nodes)
+
+            def close(self):
+                if self.importer is not None:
+                    self.importer.close()
+
+        kg_build_service.Neo4jImporter = TimedImporter
+        build_start = time.perf_counter()
+        try:
+            result = service.build_graph(os.path.join(work_dir, "kg_output"), md_path, args.prompt,
+                                         args.database, max_workers=args.workers, use_cache=args.use_cache)
+        finally:
+            kg_build_service.Neo4jImporter = importer_class
+        build_seconds = time.perf_counter() - build_start
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+
+    wall_seconds = time.perf_counter() - wall_start
+    stage_seconds = {stage: round(seconds, 2) for stage, seconds in timer.seconds.items()}
+    build_stats = dict(result.get("stats", {}))
+    if args.skip_import:
+        # 未连接 Neo4j，导入阶段的计数只表示分块经过了导入队列
+        stage_seconds.update({"import": "skipped", "merge": "skipped"})
+        build_stats["chunks_imported"] = "skipped"
+    return {
+        "file": args.file,
+        "success": result.get("success"),
+        "error": result.get("error"),
+        "chunks": len(chunks),
+        "workers": args.workers,
+        "wall_seconds": round(wall_seconds, 2),
+        "build_seconds": round(build_seconds, 2),
+        "chunks_per_second": round(len(chunks) / build_seconds, 2) if build_seconds > 0 else None,
+        "stage_seconds": stage_seconds,
+        "stage_calls": dict(timer.counts),
+        "build_stats": build_stats,
+        "scheduler": get_llm_scheduler().metrics(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线端到端知识图谱构建压测")
+    parser.add_argument("file", help="待构建的 PDF 或 markdown 文件")
+    parser.add_argument("--workers", type=int, default=4, help="并发抽取数")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT)
+    parser.add_argument("--database", default="bench", help="导入的 Neo4j 数据库名")
+    parser.add_argument("--skip-import", action="store_true", help="不连接 Neo4j，导入相关统计记为 skipped")
+    parser.add_argument("--use-cache", action="store_true", help="使用 .env 中配置的抽取缓存与近重复索引（默认使用临时文件）")
+    parser.add_argument("--base-url", help="已启动的模拟服务地址，不传时在进程内启动")
+    parser.add_argument("--port", type=int, default=8900, help="进程内启动模拟服务的端口")
+    mock_llm_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    server = None
+    if not args.base_url:
+        server = mock_llm_server.start_in_background(mock_llm_server.config_from_args(args), port=args.port)
+        args.base_url = f"http://127.0.0.1:{args.port}/v1"
+    try:
+        report = run(args)
+    finally:
+        if server is not None:
+            server.should_exit = True
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
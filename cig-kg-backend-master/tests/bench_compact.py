@@ -0,0 +1,131 @@
+"""
+紧凑输出格式压测：对比原 JSON 格式与紧凑格式的输出 token 数与抽取耗时。
+
+1. token：将 kg_output 下已有的真实抽取结果按 tests/ds1.py 提示词的类型代码表编码为紧凑格式，
+   统计两种格式的输出 token 数（ID 还原为模型原本输出的 1001 起的数字）；
+2. 耗时：在进程内启动 tests/mock_llm_server.py，按 --seconds-per-1k-tokens 模拟逐 token 生成耗时，
+   分别以两种格式抽取相同分块并统计平均耗时。
+
+用法（在项目根目录下）：
+    python -m tests.bench_compact --outputs "kg_output/x6_*" --file doc_preprocessed/X6_1.md --chunks 5
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import statistics
+import tempfile
+import time
+
+from app.utils.build_manifest import list_chunk_files
+from app.utils.compact_schema import CompactSchema
+from app.utils.llm_scheduler import estimate_tokens
+from tests import mock_llm_server
+
+DS1_PATH = os.path.join(os.path.dirname(__file__), "ds1.py")
+
+
+def load_prompt(prompt_file: str = None) -> str:
+    """默认取 tests/ds1.py 中的提示词（该脚本导入即运行，这里只读取源码）"""
+    if prompt_file:
+        with open(prompt_file, "r", encoding="utf-8") as f:
+            return f.read()
+    with open(DS1_PATH, "r", encoding="utf-8") as f:
+        return re.search(r'^prompt = """(.*?)"""', f.read(), re.S | re.M).group(1)
+
+
+def with_numeric_ids(data: dict) -> dict:
+    """把随机ID换回模型原本输出的数字ID"""
+    mapping = {node["id"]: 1001 + i for i, node in enumerate(data["nodes"])}
+    return {
+        "nodes": [{**node, "id": mapping[node["id"]]} for node in data["nodes"]],
+        "relationships": [{**rel, "from": mapping.get(rel["from"], rel["from"]), "to": mapping.get(rel["to"], rel["to"])}
+                          for rel in data["relationships"]],
+    }
+
+
+def token_report(schema: CompactSchema, pattern: str) -> dict:
+    verbose_tokens = verbose_min_tokens = compact_tokens = files = 0
+    for json_dir in glob.glob(pattern):
+        for filename in list_chunk_files(json_dir):
+            with open(os.path.join(json_dir, filename), "r", encoding="utf-8") as f:
+                try:
+                    data = with_numeric_ids(json.load(f))
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    continue
+            files += 1
+            verbose_tokens += estimate_tokens(json.dumps(data, ensure_ascii=False, indent=2))
+            verbose_min_tokens += estimate_tokens(json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+            compact_tokens += estimate_tokens(json.dumps(schema.compress(data), ensure_ascii=False,
+                                                         separators=(",", ":")))
+    if files == 0:
+        return {"files": 0}
+    return {
+        "files": files,
+        "verbose_tokens": verbose_tokens,
+        "verbose_no_indent_tokens": verbose_min_tokens,
+        "compact_tokens": compact_tokens,
+        "reduction_vs_verbose": round(1 - compact_tokens / verbose_tokens, 3),
+        "reduction_vs_no_indent": round(1 - compact_tokens / verbose_min_tokens, 3),
+    }
+
+
+def latency_report(args, prompt: str) -> dict:
+    cache_dir = tempfile.mkdtemp(prefix="bench_cache_")
+    os.environ.update({
+        "BASE_URL": f"http://127.0.0.1:{args.port}/v1", "API_KEY": "EMPTY", "MODEL_NAME": "mock-model",
+        "LLM_BACKENDS": "", "LLM_HEALTH_CHECK_SECONDS": "0", "DEDUP_ENABLED": "false",
+        "LLM_CACHE_PATH": os.path.join(cache_dir, "llm_cache.sqlite3"),
+    })
+    from app.services.kg_build_service import KGBuildService
+    from app.utils import text_split
+
+    chunks = [c.page_content for c in text_split.text_split(args.file)][:args.chunks]
+    server = mock_llm_server.start_in_background(mock_llm_server.config_from_args(args), port=args.port)
+    try:
+        report = {"chunks": len(chunks)}
+        for mode in ("verbose", "compact"):
+            service = KGBuildService()
+            service.compact_output = mode == "compact"
+            seconds = []
+            nodes = 0
+            for text in chunks:
+                start = time.perf_counter()
+                result = service.extract_kg_elements(text, prompt, use_cache=False)
+                seconds.append(time.perf_counter() - start)
+                nodes += len(result["nodes"])
+            report[mode] = {"mean_seconds": round(statistics.mean(seconds), 3),
+                            "total_seconds": round(sum(seconds), 2), "nodes": nodes}
+        report["latency_reduction"] = round(1 - report["compact"]["total_seconds"] / report["verbose"]["total_seconds"], 3)
+        return report
+    finally:
+        server.should_exit = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="紧凑输出格式的 token 与耗时对比")
+    parser.add_argument("--prompt-file", help="提示词文件，默认取 tests/ds1.py 中的提示词")
+    parser.add_argument("--outputs", default="kg_output/x6_*", help="已有抽取结果目录的 glob")
+    parser.add_argument("--file", default="doc_preprocessed/X6_1.md", help="耗时对比使用的 markdown 文件")
+    parser.add_argument("--chunks", type=int, default=5, help="耗时对比抽取的分块数，0 表示跳过")
+    parser.add_argument("--port", type=int, default=8901)
+    mock_llm_server.add_arguments(parser)
+    parser.set_defaults(latency="fixed:0.05", seconds_per_1k_tokens=1.0)
+    args = parser.parse_args()
+
+    prompt = load_prompt(args.prompt_file)
+    schema = CompactSchema.from_prompt(prompt)
+    report = {
+        "entity_types": len(schema.entity_codes),
+        "relation_types": len(schema.relation_codes),
+        "instruction_tokens": estimate_tokens(schema.instructions()),
+        "tokens": token_report(schema, args.outputs),
+    }
+    if args.chunks > 0:
+        report["latency"] = latency_report(args, prompt)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+PDF 转 markdown 压测：对比串行转换与按页段并行转换的耗时，并校验两者输出逐页一致。
+压测时关闭逐页缓存，每次计时都实际转换全部页。
+
+用法（在项目根目录下）：
+    python -m tests.bench_pdf2md --files "pdf_uploads/*.pdf" --workers 1,2,4 --pages-per-task 16
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+import pymupdf
+
+from app.services.pdf_service import PDFService
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF 转 markdown 串行与并行耗时对比")
+    parser.add_argument("--files", default="pdf_uploads/*.pdf", help="PDF 文件的 glob")
+    parser.add_argument("--workers", default=f"1,{os.cpu_count() or 1}", help="逗号分隔的进程数，1 为串行")
+    parser.add_argument("--pages-per-task", type=int, default=16, help="每个并行任务转换的页数")
+    parser.add_argument("--min-pages", type=int, default=1, help="跳过页数少于该值的文件")
+    args = parser.parse_args()
+
+    # 关闭逐页缓存（load_dotenv 不覆盖已设置的环境变量），否则第一次之后的转换都直接读缓存
+    os.environ["PDF_PAGE_CACHE_ENABLED"] = "false"
+    service = PDFService()
+    service.pages_per_task = args.pages_per_task
+    workers_list = [int(w) for w in args.workers.split(",")]
+    totals = {workers: 0.0 for workers in workers_list}
+    report = {"files": [], "cpu_count": os.cpu_count(), "pages_per_task": args.pages_per_task}
+    for file_path in sorted(glob.glob(args.files)):
+        with pymupdf.open(file_path) as doc:
+            page_count = doc.page_count
+        if page_count < args.min_pages:
+            continue
+        entry = {"file": os.path.basename(file_path), "pages": page_count, "seconds": {}}
+        baseline = None
+        for workers in workers_list:
+            start = time.perf_counter()
+            pages = service.convert_pages(file_path, workers=workers)
+            seconds = time.perf_counter() - start
+            totals[workers] += seconds
+            entry["seconds"][workers] = round(seconds, 2)
+            if baseline is None:
+                baseline = pages
+            elif pages != baseline:
+                entry.setdefault("mismatch", []).append(workers)
+        report["files"].append(entry)
+        print(json.dumps(entry, ensure_ascii=False))
+
+    report["total_pages"] = sum(entry["pages"] for entry in report["files"])
+    report["total_seconds"] = {workers: round(seconds, 2) for workers, seconds in totals.items()}
+    report["pages_per_second"] = {workers: round(report["total_pages"] / seconds, 2) if seconds else None
+                                  for workers, seconds in totals.items()}
+    report["mismatched_files"] = sum(1 for entry in report["files"] if entry.get("mismatch"))
+    print(json.dumps({k: v for k, v in report.items() if k != "files"}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+分块压测：对比内置的单遍字符分块与 LangChain RecursiveCharacterTextSplitter（相同的分隔符、3000 字符、300 重叠）。
+
+用法（在项目根目录下，需安装 langchain 与 langchain_community）：
+    python -m tests.bench_split doc_preprocessed/X6_Electrical-Instruction_Data-Sheet_Manual_CHI.md --repeat 5
+"""
+import argparse
+import json
+import time
+
+from app.utils import text_split
+
+
+def best_of(repeat: int, fn):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="内置分块与 LangChain 分块的耗时与结果对比")
+    parser.add_argument("file", nargs="?", default="doc_preprocessed/X6_Electrical-Instruction_Data-Sheet_Manual_CHI.md")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    native_seconds, native_chunks = best_of(args.repeat, lambda: text_split.text_split(args.file))
+
+    start = time.perf_counter()
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from langchain_community.document_loaders import TextLoader
+    import_seconds = time.perf_counter() - start
+
+    def langchain_split():
+        documents = TextLoader(args.file, encoding="utf-8").load()
+        splitter = RecursiveCharacterTextSplitter(chunk_size=3000, chunk_overlap=300, separators=text_split.SEPARATORS)
+        return splitter.split_documents(documents)
+
+    langchain_seconds, langchain_chunks = best_of(args.repeat, langchain_split)
+
+    with open(args.file, "r", encoding="utf-8") as f:
+        text = f.read()
+    identical = sum(1 for a, b in zip(native_chunks, langchain_chunks) if a.page_content == b.page_content)
+    offsets_valid = all(text[c.metadata["start"]:c.metadata["start"] + len(c.page_content)] == c.page_content
+                        for c in native_chunks)
+    print(json.dumps({
+        "file": args.file,
+        "chars": len(text),
+        "native": {"chunks": len(native_chunks), "seconds": round(native_seconds, 4)},
+        "langchain": {"chunks": len(langchain_chunks), "seconds": round(langchain_seconds, 4),
+                      "import_seconds": round(import_seconds, 2)},
+        "identical_chunks": identical,
+        "offsets_valid": offsets_valid,
+        "speedup": round(langchain_seconds / native_seconds, 1) if native_seconds else None,
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+规则预识别压测：标题、图片与参见改由规则识别后，每个分块发给大模型的提示词与模型输出的 token 变化。
+
+1. 提示词：tests/ds1.py 提示词与去掉规则类型后的语义提示词的 token 数；
+2. 输出：kg_output 下已有的真实抽取结果中，规则类型的节点及与其相关的关系所占的输出 token；
+3. 规则识别：对预处理文件按 token 预算分块，统计各分块规则生成的节点数与耗时。
+
+用法（在项目根目录下）：
+    python -m tests.bench_structure --outputs "kg_output/x6_*" --file doc_preprocessed/X6_1.md
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+from app.utils import text_split
+from app.utils.build_manifest import list_chunk_files
+from app.utils.llm_scheduler import estimate_tokens
+from app.utils.structure_extractor import advance_headings, get_ontology, link_structure
+from tests.bench_compact import load_prompt
+
+
+def output_report(rule_types: set, pattern: str) -> dict:
+    total_tokens = semantic_tokens = files = 0
+    for json_dir in glob.glob(pattern):
+        for filename in list_chunk_files(json_dir):
+            with open(os.path.join(json_dir, filename), "r", encoding="utf-8") as f:
+                try:
+                    data = json.load(f)
+                    rule_ids = {node["id"] for node in data["nodes"] if node["type"] in rule_types}
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    continue
+            semantic = {
+                "nodes": [node for node in data["nodes"] if node["id"] not in rule_ids],
+                "relationships": [rel for rel in data["relationships"]
+                                  if rel.get("from") not in rule_ids and rel.get("to") not in rule_ids],
+            }
+            files += 1
+            total_tokens += estimate_tokens(json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+            semantic_tokens += estimate_tokens(json.dumps(semantic, ensure_ascii=False, separators=(",", ":")))
+    return {
+        "files": files,
+        "output_tokens": total_tokens,
+        "semantic_output_tokens": semantic_tokens,
+        "saving": round(1 - semantic_tokens / total_tokens, 3) if total_tokens else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="规则预识别的 token 节省与耗时")
+    parser.add_argument("--outputs", default="kg_output/x6_*", help="已有抽取结果目录的 glob")
+    parser.add_argument("--file", default="doc_preprocessed/X6_1.md", help="用于规则识别的预处理文件")
+    parser.add_argument("--prompt-file", default=None, help="提示词文件，默认取 tests/ds1.py 中的提示词")
+    args = parser.parse_args()
+
+    prompt = load_prompt(args.prompt_file)
+    ontology = get_ontology(prompt)
+    report = {
+        "rule_types": sorted(ontology.rule_types),
+        "prompt_tokens": estimate_tokens(prompt),
+        "semantic_prompt_tokens": estimate_tokens(ontology.semantic_prompt()),
+        "outputs": output_report(ontology.rule_types, args.outputs),
+    }
+
+    chunks = list(text_split.iter_text_split_by_tokens(args.file, os.getenv("MODEL_NAME", "deepseek-chat"),
+                                                       ontology.semantic_prompt()))
+    stack = []
+    nodes = relationships = 0
+    start = time.perf_counter()
+    for chunk in chunks:
+        data, _ = link_structure(chunk.page_content, {"nodes": [], "relationships": []}, prompt, stack)
+        stack = advance_headings(stack, chunk.page_content, prompt)
+        nodes += len(data["nodes"])
+        relationships += len(data["relationships"])
+    report["structure"] = {
+        "chunks": len(chunks),
+        "nodes": nodes,
+        "relationships": relationships,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+续建导入检查：在真实的 Neo4j（需安装 APOC）上验证分块重新抽取后删除旧导入的结果。
+
+1. 导入两个分块，二者含同名的电机节点，合并重复节点；
+2. 删除分块 000 的导入：只来自 000 的节点与关系被删除，合并节点的属性与页码按分块 001 重建；
+3. 重新导入新的分块 000 后再合并，节点属性取两个分块的并集。
+
+连接信息取 .env 中的 NEO4J_URI/NEO4J_USER/NEO4J_PASSWORD；检查会合并库中全部同名节点，请在测试库上运行。
+用法（在项目根目录下）：
+    python -m tests.check_neo4j_resume --database neo4j
+"""
+import argparse
+import uuid
+
+from app.utils.neo4j_importer import Neo4jImporter
+
+
+def chunk(prefix: str, motor: str, motor_properties: dict, extra_name: str) -> dict:
+    return {
+        "nodes": [
+            {"id": f"{prefix}-1", "name": motor, "type": "设备", "properties": {"实体名": motor, **motor_properties}},
+            {"id": f"{prefix}-2", "name": extra_name, "type": "设备", "properties": {"实体名": extra_name}},
+        ],
+        "relationships": [{"name": "包含设备", "type": "包含设备", "from": f"{prefix}-1", "to": f"{prefix}-2"}],
+    }
+
+
+def nodes(importer: Neo4jImporter, doc: str) -> dict:
+    with importer.driver.session(database=importer.database) as session:
+        rows = session.run("""
+            MATCH (n) WHERE any(s IN n.sources WHERE s STARTS WITH $doc)
+            RETURN n.name AS name, n.sources AS sources, properties(n) AS properties
+        """, doc=doc + "/").data()
+    return {row["name"]: row for row in rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在 Neo4j 上检查分块重新导入时旧数据的删除")
+    parser.add_argument("--database", default="neo4j")
+    args = parser.parse_args()
+
+    # 测试数据的名称带随机前缀，不影响库中已有数据
+    doc = f"check-{uuid.uuid4().hex[:8]}"
+    first, second = f"{doc}/000.json", f"{doc}/001.json"
+    motor = f"主电机-{doc}"
+    importer = Neo4jImporter(database=args.database)
+    try:
+        importer.import_data(chunk(f"{doc}-a", motor, {"额定功率": "5kW", "来源页码": [1]}, f"旧子设备-{doc}"), first)
+        importer.import_data(chunk(f"{doc}-b", motor, {"型号": "M-2", "来源页码": [3]}, f"其他子设备-{doc}"), second)
+        importer.merge_duplicate_nodes()
+        merged = nodes(importer, doc)[motor]
+        assert sorted(merged["sources"]) == [first, second], merged
+        assert merged["properties"].get("pages") == [1, 3], merged
+
+        importer.delete_source(first)
+        result = nodes(importer, doc)
+        assert f"旧子设备-{doc}" not in result, result
+        rebuilt = result[motor]["properties"]
+        assert rebuilt["sources"] == [second], rebuilt
+        assert "额定功率" not in rebuilt and rebuilt.get("型号") == "M-2", rebuilt
+        assert rebuilt.get("pages") == [3], rebuilt
+
+        importer.import_data(chunk(f"{doc}-c", motor, {"额定功率": "7.5kW", "来源页码": [2]}, f"新子设备-{doc}"), first)
+        importer.merge_duplicate_nodes()
+        final = nodes(importer, doc)[motor]["properties"]
+        assert final.get("额定功率") == "7.5kW" and final.get("型号") == "M-2", final
+        assert final.get("pages") == [2, 3], final
+        print("ok: 旧分块的节点、关系与合并节点上的旧属性均已删除")
+    finally:
+        importer.delete_source(first)
+        importer.delete_source(second)
+        importer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,13 @@ import os
 import re
 from typing import Dict, Any, List
 from dotenv import load_dotenv
-from openai import OpenAI
+from app.utils.llm_client import get_llm_client
+from app.utils.llm_scheduler import get_llm_scheduler
 from app.services.kg_build_service import save_kg_data
 from app.utils import id_assign, text_split
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("API_KEY", "API_KEY"), base_url=os.getenv("BASE_URL", "BASE_URL"))
+client = get_llm_client()
 
 conversation_history = []
 prompt = """
@@ -180,12 +181,12 @@ for index, chunk in enumerate(chunks):
         {"role": "user", "content": user_prompt}
     ]
 
-    response = client.chat.completions.create(
+    response = get_llm_scheduler().call(lambda: client.chat.completions.create(
         model="deepseek-chat",
         max_tokens=8192,
         messages=messages,
         response_format={'type': 'json_object'},
-    )
+    ))
 
     # 打开并读取文件
     # with open(f"../kg_output/qwen/{index}", "w", encoding="utf-8") as file:
@@ -0,0 +1,224 @@
+"""
+本地模拟的 OpenAI 兼容大模型服务，用于离线压测知识图谱构建流程，不消耗真实 token。
+
+根据待处理文本生成形如真实抽取结果的 nodes/relationships：
+标题行生成“标题”节点，“名称：取值”行生成“参数”节点，**加粗**与【】内的词生成“设备”节点，
+除标题外的节点与其所属的最近标题之间生成“包含”关系。提示词要求紧凑输出格式时按其类型代码表编码输出。
+与 vLLM/DeepSeek 的前缀缓存一样，之前出现过的系统消息在 usage.prompt_tokens_details.cached_tokens 中计为缓存命中。
+
+启动方式（在项目根目录下）：
+    python -m tests.mock_llm_server --port 8900 --latency lognormal:0.0,0.5 --error-rate 0.02 --throttle-rate 0.02
+
+之后在 .env 中设置 BASE_URL=http://127.0.0.1:8900/v1 即可让构建流程调用该服务。
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Any, Dict, List
+
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+from app.utils.compact_schema import CompactSchema
+from app.utils.llm_scheduler import estimate_tokens
+
+HEADING_PATTERN = re.compile(r"^#{1,6}\s+(.+)$")
+PARAM_PATTERN = re.compile(r"^[-*\s]*([^：:|#\n]{1,30})[：:]\s*([^：:\n]{1,60})$")
+DEVICE_PATTERN = re.compile(r"\*\*([^*\n]{1,30})\*\*|【([^】\n]{1,30})】")
+TEXT_MARKER = "待处理文本："
+COMPACT_MARKER = "紧凑输出格式"
+
+
+class MockConfig:
+    """模拟服务的耗时分布与错误注入配置"""
+
+    def __init__(self, latency: str = "fixed:0.2", error_rate: float = 0.0, throttle_rate: float = 0.0,
+                 truncate_rate: float = 0.0, retry_after: float = 1.0, seconds_per_1k_tokens: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.truncate_rate = truncate_rate
+        self.retry_after = retry_after
+        self.seconds_per_1k_tokens = seconds_per_1k_tokens
+        self.sample_latency()  # 启动时校验耗时分布配置
+
+    def sample_latency(self) -> float:
+        """按配置的分布采样一次请求耗时（秒）
+
+        支持 fixed:秒、uniform:下限,上限、lognormal:mu,sigma、exponential:均值
+        """
+        kind, _, params = self.latency.partition(":")
+        values = [float(v) for v in params.split(",") if v]
+        if kind == "fixed":
+            return values[0]
+        if kind == "uniform":
+            return random.uniform(values[0], values[1])
+        if kind == "lognormal":
+            return random.lognormvariate(values[0], values[1])
+        if kind == "exponential":
+            return random.expovariate(1.0 / values[0])
+        raise ValueError(f"不支持的耗时分布: {self.latency}")
+
+
+def extract_text(messages: List[Dict[str, Any]]) -> str:
+    """取最后一条用户消息中“待处理文本：”之后的部分"""
+    content = messages[-1].get("content", "") if messages else ""
+    if TEXT_MARKER in content:
+        return content.rsplit(TEXT_MARKER, 1)[1]
+    return content
+
+
+def mock_kg_elements(text: str) -> Dict[str, Any]:
+    """根据文本生成模拟的知识图谱抽取结果"""
+    nodes = []
+    relationships = []
+    names = {}
+    heading_id = None
+
+    def add_node(name: str, node_type: str) -> int:
+        key = (name, node_type)
+        if key not in names:
+            names[key] = len(nodes) + 1
+            nodes.append({"id": names[key], "name": name, "type": node_type, "properties": {"实体名": name}})
+        return names[key]
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        heading = HEADING_PATTERN.match(line)
+        if heading:
+            heading_id = add_node(heading.group(1).strip("* "), "标题")
+            continue
+        found = []
+        param = PARAM_PATTERN.match(line)
+        if param:
+            found.append(add_node(f"{param.group(1).strip()}：{param.group(2).strip()}", "参数"))
+        for match in DEVICE_PATTERN.finditer(line):
+            found.append(add_node((match.group(1) or match.group(2)).strip(), "设备"))
+        if heading_id is not None:
+            for node_id in found:
+                relationships.append({"name": "包含", "from": heading_id, "to": node_id, "type": "包含"})
+
+    return {"nodes": nodes, "relationships": relationships}
+
+
+def create_app(config: MockConfig) -> FastAPI:
+    app = FastAPI(title="Mock LLM Server")
+    stats = {"requests": 0, "errors": 0, "throttled": 0, "truncated": 0}
+    stats_lock = threading.Lock()
+    seen_prefixes = set()
+
+    def count(key: str):
+        with stats_lock:
+            stats[key] += 1
+
+    @app.get("/v1/models")
+    def list_models():
+        return {"object": "list", "data": [{"id": "mock-model", "object": "model", "owned_by": "mock"}]}
+
+    @app.get("/stats")
+    def get_stats():
+        with stats_lock:
+            return dict(stats)
+
+    # 同步处理函数在线程池中执行，time.sleep 模拟的耗时不会阻塞其他请求
+    @app.post("/v1/chat/completions")
+    def chat_completions(body: Dict[str, Any]):
+        count("requests")
+        messages = body.get("messages", [])
+        prompt_text = "".join(str(m.get("content", "")) for m in messages)
+        prompt_tokens = estimate_tokens(prompt_text)
+        prefix = str(messages[0].get("content", "")) if messages and messages[0].get("role") == "system" else ""
+        with stats_lock:
+            cached_tokens = estimate_tokens(prefix) if prefix in seen_prefixes else 0
+            seen_prefixes.add(prefix)
+
+        roll = random.random()
+        if roll < config.throttle_rate:
+            count("throttled")
+            time.sleep(0.01)
+            return JSONResponse(status_code=429, headers={"retry-after": str(config.retry_after)},
+                                content={"error": {"message": "Rate limit reached", "type": "rate_limit_error"}})
+        if roll < config.throttle_rate + config.error_rate:
+            count("errors")
+            time.sleep(config.sample_latency() / 2)
+            return JSONResponse(status_code=500, content={"error": {"message": "Mock server error", "type": "server_error"}})
+
+        result = mock_kg_elements(extract_text(messages))
+        if COMPACT_MARKER in prompt_text:
+            content = json.dumps(CompactSchema.from_prompt(prompt_text).compress(result), ensure_ascii=False,
+                                 separators=(",", ":"))
+        else:
+            # 与真实模型在 json_object 模式下的输出一样带缩进
+            content = json.dumps(result, ensure_ascii=False, indent=2)
+        completion_tokens = estimate_tokens(content)
+        finish_reason = "stop"
+        if random.random() < config.truncate_rate:
+            count("truncated")
+            content = content[:max(1, len(content) * 2 // 3)]
+            finish_reason = "length"
+
+        time.sleep(config.sample_latency() + completion_tokens / 1000 * config.seconds_per_1k_tokens)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock-model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": finish_reason,
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+        }
+
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", default="fixed:0.2",
+                        help="耗时分布：fixed:秒 | uniform:下限,上限 | lognormal:mu,sigma | exponential:均值")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的概率")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="返回 429 的概率")
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="输出被截断（finish_reason=length）的概率")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 响应的 Retry-After 秒数")
+    parser.add_argument("--seconds-per-1k-tokens", type=float, default=0.0, help="每生成 1000 个 token 额外增加的耗时")
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(latency=args.latency, error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                      truncate_rate=args.truncate_rate, retry_after=args.retry_after,
+                      seconds_per_1k_tokens=args.seconds_per_1k_tokens)
+
+
+def start_in_background(config: MockConfig, host: str = "127.0.0.1", port: int = 8900) -> uvicorn.Server:
+    """在后台线程中启动模拟服务，返回后即可接受请求"""
+    server = uvicorn.Server(uvicorn.Config(create_app(config), host=host, port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="mock-llm-server", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的 OpenAI 兼容大模型服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,13 @@ import os
 import re
 from typing import Dict, Any, List
 from dotenv import load_dotenv
-from openai import OpenAI
+from app.utils.llm_client import get_llm_client
+from app.utils.llm_scheduler import get_llm_scheduler
 from app.services.kg_build_service import save_kg_data
 from app.utils import id_assign, text_split
 
 load_dotenv()
-client = OpenAI(
-    api_key=os.getenv("QWEN_API_KEY", "API_KEY"),
-    base_url=os.getenv("QWEN_API_BASE", "BASE_URL")
-)
+client = get_llm_client(api_key=os.getenv("QWEN_API_KEY", "API_KEY"), base_url=os.getenv("QWEN_API_BASE", "BASE_URL"))
 
 conversation_history = []
 prompt = """
@@ -174,7 +172,7 @@ for index, chunk in enumerate(chunks):
         {"role": "user", "content": user_prompt}
     ]
 
-    response = client.chat.completions.create(
+    response = get_llm_scheduler().call(lambda: client.chat.completions.create(
         model="autodl-tmp/models/Qwen2.5-7B-Instruct",
         messages=messages,
         temperature=0.7,
@@ -184,7 +182,7 @@ for index, chunk in enumerate(chunks):
         extra_body={
             "repetition_penalty": 1.05,
         },
-    )
+    ))
 
     # 打开并读取文件
     with open(f"../kg_output/qwen/{index}", "w", encoding="utf-8") as file:
@@ -4,7 +4,8 @@ import re
 from typing import Dict, Any, List
 from dotenv import load_dotenv
 from fastapi import Depends
-from openai import OpenAI
+from app.utils.llm_client import get_llm_client
+from app.utils.llm_scheduler import get_llm_scheduler
 from app.services.kg_build_service import save_kg_data
 
 prompt = """
@@ -91,21 +92,18 @@ def extract_kg_elements(text: str, prompt: str) -> Dict[str, Any]:
         {"role": "user", "content": user_prompt}
     ]
 
-    response = client.chat.completions.create(
+    response = get_llm_scheduler().call(lambda: client.chat.completions.create(
         model="deepseek-chat",
         messages=messages,
         response_format={'type': 'json_object'},
         max_tokens=8192
-    )
+    ))
 
     result = json.loads(response.choices[0].message.content)
     return result
 
 load_dotenv()
-client = OpenAI(
-            api_key=os.getenv("API_KEY", "API_KEY"),
-            base_url=os.getenv("BASE_URL", "BASE_URL")
-        )
+client = get_llm_client()
 preprocessed_path = "F:\毕设\Code\cig-kg-backend\doc_preprocessed\卷包（成型）在线质量检测装置_20250416_144853.txt"
 chunks = split_text_by_chars(preprocessed_path, max_chars=3200)
 